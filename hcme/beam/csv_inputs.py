@@ -0,0 +1,169 @@
+"""
+Writers for BEAM's CSV scenario format (``beam.exchange.scenario.fileFormat = "csv"``).
+
+The writers consume the same records as the XML templates and write them in chunks of
+``CHUNK_SIZE`` records with pandas, streaming to plain or ``.gz`` outputs.
+
+Note:
+    BEAM requires an integer ``age`` for every person, which is not modelled yet.  Persons
+    without ``age`` or ``is_female`` in their record are written with ``DEFAULT_AGE`` and
+    ``DEFAULT_IS_FEMALE``, which can be overridden with the keyword arguments of
+    ``write_csv``.
+"""
+import itertools
+from typing import Callable, Dict, Iterable, Iterator, List
+
+import pandas as pd
+from loguru import logger
+
+from .factory import open_output
+
+CHUNK_SIZE = 10000
+
+# Placeholders for person attributes which BEAM requires but are not modelled yet
+DEFAULT_AGE = 30
+DEFAULT_IS_FEMALE = False
+
+PLANS = "plans"
+PERSONS = "persons"
+HOUSEHOLDS = "households"
+
+columns = {
+    PLANS: [
+        "personId",
+        "planIndex",
+        "planScore",
+        "planSelected",
+        "planElementType",
+        "planElementIndex",
+        "activityType",
+        "activityLocationX",
+        "activityLocationY",
+        "activityEndTime",
+        "legMode",
+    ],
+    PERSONS: [
+        "personId",
+        "householdId",
+        "age",
+        "isFemale",
+        "householdRank",
+        "excludedModes",
+        "valueOfTime",
+    ],
+    HOUSEHOLDS: ["householdId", "cars", "incomeValue", "locationX", "locationY"],
+}
+
+
+def to_seconds(times: pd.Series) -> pd.Series:
+    """Convert "H:MM:SS" activity end times to seconds after midnight, dropping missing times."""
+    times = times.dropna()
+    if times.empty:
+        return times.astype(float)
+    times = times.astype(str)
+    parts = times.str.split(":", expand=True).astype(float)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def plans_frame(population: list) -> pd.DataFrame:
+    """One row per plan element of the selected plan of each person."""
+    # Only the selected plan is written, so the plan columns are constant
+    plan_columns = ["planIndex", "planScore", "planSelected"]
+    data = {column: [] for column in columns[PLANS] if column not in plan_columns}
+    for person in population:
+        index = 0
+        for activity in person.get("plan") or []:
+            elements = ["leg", "activity"] if activity.get("mode") else ["activity"]
+            for element in elements:
+                leg = element == "leg"
+                data["personId"].append(person["id"])
+                data["planElementType"].append(element)
+                data["planElementIndex"].append(index)
+                data["activityType"].append(None if leg else activity.get("type"))
+                data["activityLocationX"].append(None if leg else activity.get("x"))
+                data["activityLocationY"].append(None if leg else activity.get("y"))
+                data["activityEndTime"].append(None if leg else activity.get("end_time"))
+                data["legMode"].append(activity["mode"] if leg else None)
+                index += 1
+
+    df = pd.DataFrame(data, columns=columns[PLANS])
+    df["planIndex"] = 0
+    df["planScore"] = 0
+    df["planSelected"] = True
+    df["activityEndTime"] = to_seconds(df["activityEndTime"]).reindex(df.index)
+    return df
+
+
+def persons_frame(
+    population: list, age: int = DEFAULT_AGE, is_female: bool = DEFAULT_IS_FEMALE
+) -> pd.DataFrame:
+    """One row per person, where ``age`` and ``is_female`` fill in missing attributes."""
+    df = pd.DataFrame.from_records(population)
+    ages = df.get("age", pd.Series(age, index=df.index)).fillna(age)
+    females = df.get("is_female", pd.Series(is_female, index=df.index)).fillna(is_female)
+    return pd.DataFrame(
+        {
+            "personId": df["id"],
+            "householdId": df["household_id"],
+            "age": ages.astype(int),
+            "isFemale": females.astype(bool),
+            "householdRank": df["rank"],
+            "excludedModes": df["excluded_modes"].map(",".join),
+            "valueOfTime": 0,
+        },
+        columns=columns[PERSONS],
+    )
+
+
+def households_frame(households: list) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(households)
+    return pd.DataFrame(
+        {
+            "householdId": df["id"],
+            "cars": df["vehicles"].map(len),
+            "incomeValue": df["income"],
+            "locationX": df["homecoordx"],
+            "locationY": df["homecoordy"],
+        },
+        columns=columns[HOUSEHOLDS],
+    )
+
+
+frame_registry: Dict[str, Callable[..., pd.DataFrame]] = {
+    PLANS: plans_frame,
+    PERSONS: persons_frame,
+    HOUSEHOLDS: households_frame,
+}
+
+
+def chunks(records: Iterable[Dict], n: int) -> Iterator[List[Dict]]:
+    """Split records into lists of at most n records."""
+    records = iter(records)
+    while True:
+        records_chunk = list(itertools.islice(records, n))
+        if not records_chunk:
+            return
+        yield records_chunk
+
+
+def write_csv(
+    name: str, output: str, records: Iterable[Dict], compresslevel: int = None, **options
+) -> int:
+    """Stream records to a BEAM CSV input and return the number of rows written.
+
+    Args:
+        name: One of ``plans``, ``persons`` or ``households``.
+        output: Output path, compressed with gzip when it ends with ``.gz``.
+        records: Records as consumed by the matching XML template.
+        options: Keyword arguments of the frame function, e.g. ``age`` for persons.
+    """
+    logger.info("Generating {name} to {f}", name=name, f=output)
+    to_frame = frame_registry[name]
+    n = 0
+    with open_output(output, "w", compresslevel) as fh:
+        fh.write(",".join(columns[name]) + "\n")
+        for records_chunk in chunks(records, CHUNK_SIZE):
+            df = to_frame(records_chunk, **options)
+            df.to_csv(fh, header=False, index=False)
+            n += len(df)
+    return n
@@ -0,0 +1,78 @@
+"""
+Parquet copies of BEAM event files.
+
+An event file is converted once into a Parquet dataset partitioned by event type and
+hour of the day.  Copies are keyed by the path, size and modification time of the
+source, so re-running BEAM into the same directory invalidates them.  Reads are memory
+mapped and only load the partitions and columns asked for.
+"""
+import hashlib
+import itertools
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+from loguru import logger
+
+from hcme.beam.events.reader import iter_batches
+
+HOUR = "hour"
+
+partitioning = ds.partitioning(
+    pa.schema([("type", pa.string()), (HOUR, pa.int32())]), flavor="hive"
+)
+
+
+def cache_key(path: Path) -> str:
+    """Digest of the path, size and modification time of a file."""
+    stat = os.stat(path)
+    key = f"{Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _batches(path: Path, columns: List[str]) -> Iterable[pa.RecordBatch]:
+    for batch in iter_batches(path, columns):
+        # Partition columns are written as plain strings and integers
+        arrays = [
+            column.cast(pa.string()) if name == "type" else column
+            for name, column in zip(batch.schema.names, batch.columns)
+        ]
+        hour = pc.cast(pc.floor(pc.divide(batch.column("time"), 3600.0)), pa.int32())
+        yield pa.RecordBatch.from_arrays(arrays + [hour], names=batch.schema.names + [HOUR])
+
+
+def convert(path: Path, output: Path, columns: List[str]) -> Path:
+    """Convert an events csv to a Parquet dataset partitioned by event type and hour."""
+    logger.info("Converting {path} to {output}", path=path, output=output)
+    staging = output.with_name(output.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    batches = _batches(path, columns)
+    first = next(batches, None)
+    if first is None:
+        raise ValueError(f"No events in {path}")
+    ds.write_dataset(
+        itertools.chain([first], batches),
+        str(staging),
+        schema=first.schema,
+        format="parquet",
+        partitioning=partitioning,
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    # Only complete conversions are visible under the cache key
+    staging.rename(output)
+    return output
+
+
+def open_dataset(path: Path) -> ds.Dataset:
+    """Open a converted events dataset with memory mapped reads."""
+    return ds.dataset(
+        str(path),
+        format="parquet",
+        partitioning=partitioning,
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
@@ -0,0 +1,161 @@
+"""
+Byte offset index of the rows of each person and vehicle in an events file.
+
+The index is a SQLite sidecar written next to the events file in a single sequential
+scan.  Lookups read the header and seek to the indexed rows only:
+
+    .. code-block:: python
+
+        index = EventIndex("ITERS/it.10/10.events.csv")
+        events = index.read(person="10064")
+"""
+import csv
+import io
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from hcme.beam.events.reader import dtypes
+
+PERSON = "person"
+VEHICLE = "vehicle"
+
+# Row ranges inserted per transaction while building an index
+BATCH_SIZE = 100000
+
+# Keys looked up per query, below SQLite's limit of query parameters
+QUERY_BATCH_SIZE = 500
+
+
+def _stamp(path: Path) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def scan_ranges(fh, columns: List[str]) -> Iterable[Tuple[str, str, int, int]]:
+    """Yield ``(column, key, start, end)`` byte ranges of contiguous rows of each key.
+
+    Args:
+        fh: Events file opened in binary mode, positioned at the header.
+        columns: Columns to index, e.g. ``["person", "vehicle"]``.
+    """
+    header = next(csv.reader([fh.readline().decode("utf-8")]))
+    positions = [(column, header.index(column)) for column in columns if column in header]
+    # Open range of each key, extended while its rows are adjacent
+    ranges: Dict[Tuple[str, str], List[int]] = {}
+    start = fh.tell()
+    for line in iter(fh.readline, b""):
+        end = start + len(line)
+        row = next(csv.reader([line.decode("utf-8")]))
+        for column, position in positions:
+            key = row[position] if position < len(row) else ""
+            if not key:
+                continue
+            current = ranges.get((column, key))
+            if current is not None and current[1] == start:
+                current[1] = end
+                continue
+            if current is not None:
+                yield column, key, current[0], current[1]
+            ranges[(column, key)] = [start, end]
+        start = end
+    for (column, key), (first, last) in ranges.items():
+        yield column, key, first, last
+
+
+def merge_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Union of byte ranges, so that rows in several ranges are read once."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class EventIndex:
+    """Index of an events csv by person and vehicle, rebuilt when the file changes."""
+
+    def __init__(self, path: str, index_path: str = None, columns: List[str] = None):
+        self.path = Path(path)
+        if self.path.suffix == ".gz":
+            raise ValueError(f"Cannot index compressed events file {self.path}")
+        self.index_path = Path(index_path or f"{self.path}.index.sqlite")
+        self.columns = columns or [PERSON, VEHICLE]
+        if not self.is_current():
+            self.build()
+
+    def is_current(self) -> bool:
+        if not self.index_path.exists():
+            return False
+        with sqlite3.connect(str(self.index_path)) as connection:
+            try:
+                (stamp,) = connection.execute("SELECT stamp FROM meta").fetchone()
+            except sqlite3.DatabaseError:
+                return False
+        return stamp == _stamp(self.path)
+
+    def build(self) -> None:
+        """Scan the events file once and write the index."""
+        logger.info("Indexing {f}", f=self.path)
+        staging = self.index_path.with_name(self.index_path.name + ".tmp")
+        staging.unlink(missing_ok=True)
+        connection = sqlite3.connect(str(staging))
+        connection.execute("CREATE TABLE meta (stamp TEXT)")
+        connection.execute("CREATE TABLE ranges (kind TEXT, key TEXT, start INTEGER, end INTEGER)")
+        with open(self.path, "rb") as fh:
+            ranges = scan_ranges(fh, self.columns)
+            batch = []
+            for row in ranges:
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    connection.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?)", batch)
+                    batch = []
+            connection.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?)", batch)
+        connection.execute("INSERT INTO meta VALUES (?)", (_stamp(self.path),))
+        connection.execute("CREATE INDEX ranges_key ON ranges (kind, key, start)")
+        connection.commit()
+        connection.close()
+        staging.replace(self.index_path)
+
+    def ranges(self, kind: str, keys: Iterable[str]) -> List[Tuple[int, int]]:
+        """Byte ranges of the rows of ``keys``, in file order."""
+        keys = [str(key) for key in keys]
+        ranges = []
+        with sqlite3.connect(str(self.index_path)) as connection:
+            for i in range(0, len(keys), QUERY_BATCH_SIZE):
+                batch = keys[i : i + QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                ranges += connection.execute(
+                    f"SELECT start, end FROM ranges WHERE kind = ? AND key IN ({placeholders})",
+                    [kind, *batch],
+                ).fetchall()
+        return sorted(ranges)
+
+    def read(self, person: str = None, vehicles: Iterable[str] = None) -> pd.DataFrame:
+        """Read the events of a person or of a set of vehicles.
+
+        Args:
+            person: Person id whose rows to read.
+            vehicles: Vehicle ids whose rows to read.
+        """
+        ranges = []
+        if person is not None:
+            ranges += self.ranges(PERSON, [person])
+        if vehicles is not None:
+            ranges += self.ranges(VEHICLE, vehicles)
+        with open(self.path, "rb") as fh:
+            buffer = io.BytesIO()
+            buffer.write(fh.readline())
+            for start, end in merge_ranges(ranges):
+                fh.seek(start)
+                buffer.write(fh.read(end - start))
+        buffer.seek(0)
+        events = pd.read_csv(buffer, dtype={PERSON: "string", VEHICLE: "string"})
+        categories = {c: dtypes[c] for c in events.columns if dtypes.get(c) == "category"}
+        return events.astype(categories)
@@ -0,0 +1,160 @@
+"""
+Stream BEAM event files in typed chunks.
+
+Event files of a county-scale run do not fit in memory as object columns.  Readers here
+only parse the requested columns, store repeated strings such as event types and modes
+as categoricals and drop events of other types chunk by chunk.
+"""
+from typing import Iterable, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from pandas.api.types import union_categoricals
+
+PANDAS = "pandas"
+PYARROW = "pyarrow"
+
+# Rows per chunk yielded by the readers
+CHUNKSIZE = 1_000_000
+
+# Columns kept for person events
+EVENT_COLUMNS = [
+    "person",
+    "vehicle",
+    "time",
+    "link",
+    "type",
+    "legMode",
+    "location",
+    "mode",
+    "currentTourMode",
+    "personalVehicleAvailable",
+    "tourIndex",
+    "availableAlternatives",
+]
+
+# Columns kept for physsim (vehicle) events
+PHYSSIM_COLUMNS = ["person", "vehicle", "time", "link", "type"]
+
+CATEGORICAL_COLUMNS = ["type", "mode", "legMode", "currentTourMode"]
+
+dtypes = {
+    "person": "string",
+    "vehicle": "string",
+    "time": "float64",
+    "link": "float64",
+    "location": "string",
+    "personalVehicleAvailable": "string",
+    "tourIndex": "float64",
+    "availableAlternatives": "string",
+    **{column: "category" for column in CATEGORICAL_COLUMNS},
+}
+
+arrow_types = {
+    "person": pa.string(),
+    "vehicle": pa.string(),
+    "time": pa.float64(),
+    "link": pa.float64(),
+    "location": pa.string(),
+    "personalVehicleAvailable": pa.string(),
+    "tourIndex": pa.float64(),
+    "availableAlternatives": pa.string(),
+    **{column: pa.dictionary(pa.int32(), pa.string()) for column in CATEGORICAL_COLUMNS},
+}
+
+
+def _read_pandas(path, columns, types, chunksize) -> Iterable[pd.DataFrame]:
+    reader = pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={c: dtypes[c] for c in columns if c in dtypes},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        if types is not None:
+            chunk = chunk[chunk["type"].isin(types)]
+            chunk = chunk.assign(type=chunk["type"].cat.remove_unused_categories())
+        yield chunk
+
+
+def iter_batches(path: str, columns: List[str], types: List[str] = None):
+    """Stream an events csv as Arrow record batches, parsed in parallel threads."""
+    reader = pv.open_csv(
+        str(path),
+        convert_options=pv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: arrow_types[c] for c in columns if c in arrow_types},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        if types is not None:
+            batch = batch.filter(pc.is_in(batch.column("type").cast(pa.string()), pa.array(types)))
+        yield batch
+
+
+def _read_pyarrow(path, columns, types, chunksize) -> Iterable[pd.DataFrame]:
+    batches = []
+    rows = 0
+    for batch in iter_batches(path, columns, types):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunksize:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches = []
+            rows = 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+readers = {PANDAS: _read_pandas, PYARROW: _read_pyarrow}
+
+
+def iter_csv(
+    path: str,
+    columns: List[str],
+    types: List[str] = None,
+    chunksize: int = CHUNKSIZE,
+    engine: str = PANDAS,
+) -> Iterable[pd.DataFrame]:
+    """Stream an events csv file in typed chunks of about ``chunksize`` rows.
+
+    Args:
+        path: Path to an events csv, optionally gzip compressed with pandas.
+        columns: Columns to parse, all others are skipped.
+        types: Only keep events of these types, e.g. ``["PathTraversal"]``.
+        engine: ``"pandas"`` or ``"pyarrow"``, which parses blocks of the file in
+            parallel threads.
+    """
+    if types is not None and "type" not in columns:
+        columns = [*columns, "type"]
+    return readers[engine](path, columns, types, chunksize)
+
+
+def empty_frame(columns: List[str]) -> pd.DataFrame:
+    """Frame without rows with the dtypes of ``columns``."""
+    return pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, "object")) for c in columns})
+
+
+def concat_chunks(chunks: Iterable[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """Concatenate chunks into one frame, keeping categorical columns categorical.
+
+    Each chunk has its own categories, which `pandas.concat` would fall back to ``object``
+    for.  The categories of every chunk are combined first.
+
+    Args:
+        chunks: Chunks as yielded by `iter_csv`.
+        columns: Columns of the empty frame returned when there are no chunks.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return empty_frame(columns)
+    for column in chunks[0].select_dtypes("category").columns:
+        categories = union_categoricals([chunk[column] for chunk in chunks]).categories
+        chunks = [
+            chunk.assign(**{column: chunk[column].cat.set_categories(categories)})
+            for chunk in chunks
+        ]
+    return pd.concat(chunks, ignore_index=True)
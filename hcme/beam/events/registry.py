@@ -1,8 +1,27 @@
 """
 Parse BEAM agent events.
 """
+import shutil
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterable, List
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from hcme.beam.events import cache
+from hcme.beam.events.index import EventIndex
+from hcme.beam.events.reader import (
+    CATEGORICAL_COLUMNS,
+    CHUNKSIZE,
+    EVENT_COLUMNS,
+    PANDAS,
+    PHYSSIM_COLUMNS,
+    iter_csv,
+)
+
+EVENTS = "events"
+PHYSSIM = "physsim"
 
 
 @dataclass
@@ -12,9 +31,13 @@ class Registry:
 
     default_inum: int = None
 
+    # Directory of Parquet copies of event files, defaults to ``.parquet`` in ``root``
+    cache_dir: str = None
+
     def __post_init__(self):
         self.root = Path(self.root)
         assert self.root.exists()
+        self.cache_dir = Path(self.cache_dir or self.root / ".parquet")
 
         self.iter_num = self.default_inum
 
@@ -28,6 +51,77 @@ class Registry:
         self.physsim = self.it_dir / f"{self.iter_num}.physSimEvents.csv"
         self.events = self.it_dir / f"{self.iter_num}.events.csv"
 
+    def iter_events(
+        self,
+        source: str = EVENTS,
+        chunksize: int = CHUNKSIZE,
+        types: List[str] = None,
+        columns: List[str] = None,
+        engine: str = PANDAS,
+    ) -> Iterable[pd.DataFrame]:
+        """Stream the events of the current iteration in typed chunks.
+
+        Args:
+            source: ``"events"`` for agent events or ``"physsim"`` for physsim events.
+            chunksize: Rows per chunk.
+            types: Only keep events of these types.
+            columns: Columns to read, defaults to the columns used by the analyses.
+            engine: ``"pandas"`` or ``"pyarrow"``.
+        """
+        path, default_columns = self._source(source)
+        return iter_csv(path, columns or default_columns, types, chunksize, engine)
+
+    def _source(self, source: str):
+        return {
+            EVENTS: (self.events, EVENT_COLUMNS),
+            PHYSSIM: (self.physsim, PHYSSIM_COLUMNS),
+        }[source]
+
+    def parquet(self, source: str = EVENTS) -> Path:
+        """Path of the Parquet copy of an event file, converting the file on first access."""
+        path, columns = self._source(source)
+        output = self.cache_dir / f"{path.name}.{cache.cache_key(path)}"
+        if not output.exists():
+            # Drop copies of previous versions of the file
+            for stale in self.cache_dir.glob(f"{path.name}.*"):
+                shutil.rmtree(stale)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            cache.convert(path, output, columns)
+        return output
+
+    def index(self, source: str = EVENTS) -> EventIndex:
+        """Person and vehicle index of an event file, built on first access."""
+        path, _ = self._source(source)
+        return EventIndex(path)
+
+    def dataset(self, source: str = EVENTS) -> ds.Dataset:
+        """Memory mapped dataset of an event file, partitioned by ``type`` and ``hour``."""
+        return cache.open_dataset(self.parquet(source))
+
+    def read_cached(
+        self,
+        source: str = EVENTS,
+        types: List[str] = None,
+        hours: List[int] = None,
+        columns: List[str] = None,
+    ) -> pd.DataFrame:
+        """Read events from the Parquet copy, loading only matching partitions and columns.
+
+        Args:
+            types: Only read events of these types.
+            hours: Only read events starting in these hours of the simulation.
+            columns: Columns to read, defaults to every column.
+        """
+        predicate = None
+        if types is not None:
+            predicate = ds.field("type").isin(types)
+        if hours is not None:
+            in_hours = ds.field(cache.HOUR).isin(hours)
+            predicate = in_hours if predicate is None else predicate & in_hours
+        table = self.dataset(source).to_table(columns=columns, filter=predicate)
+        categories = [c for c in CATEGORICAL_COLUMNS if c in table.column_names]
+        return table.to_pandas(categories=categories)
+
     @property
     def iter_num(self):
         return self._iter_num
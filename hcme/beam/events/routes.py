@@ -0,0 +1,78 @@
+"""
+Reconstruct the routes of every person from BEAM events in a single pass.
+
+Persons are in a vehicle between their ``PersonEntersVehicle`` and ``PersonLeavesVehicle``
+events.  The links traversed during each such window are the link events of the vehicle
+within the window, found with a sorted interval join on ``(vehicle, time)``.
+"""
+import numpy as np
+import pandas as pd
+
+ENTERS_VEHICLE = "PersonEntersVehicle"
+LEAVES_VEHICLE = "PersonLeavesVehicle"
+
+ROUTE_COLUMNS = ["person", "leg", "vehicle", "departure", "arrival", "sequence", "time", "link"]
+
+
+def vehicle_windows(events: pd.DataFrame) -> pd.DataFrame:
+    """Pair the enter and leave vehicle events of each person into windows.
+
+    The n-th time a person enters a vehicle is paired with the n-th time they leave it.
+    Windows are numbered per person in order of departure as ``leg``.
+    """
+    keys = ["person", "vehicle"]
+    columns = keys + ["time"]
+    enters = events.loc[events["type"] == ENTERS_VEHICLE, columns].sort_values(columns)
+    leaves = events.loc[events["type"] == LEAVES_VEHICLE, columns].sort_values(columns)
+    enters["n"] = enters.groupby(keys, observed=True).cumcount()
+    leaves["n"] = leaves.groupby(keys, observed=True).cumcount()
+    windows = enters.merge(leaves, on=keys + ["n"], suffixes=("_enter", "_leave"))
+    windows = windows.rename(columns={"time_enter": "departure", "time_leave": "arrival"})
+    windows = windows.sort_values(["person", "departure"], ignore_index=True)
+    windows["leg"] = windows.groupby("person", observed=True).cumcount()
+    return windows[["person", "leg", "vehicle", "departure", "arrival"]]
+
+
+def reconstruct_routes(events: pd.DataFrame, physsim: pd.DataFrame) -> pd.DataFrame:
+    """Links traversed on every leg of every person.
+
+    Args:
+        events: Agent events with ``person``, ``vehicle``, ``time`` and ``type`` columns.
+        physsim: Vehicle events with ``vehicle``, ``time`` and ``link`` columns.
+
+    Returns:
+        One row per link of each leg, ordered by person, leg and time.  Repeated events on
+        the same link, e.g. entering and leaving it, are collapsed.
+    """
+    windows = vehicle_windows(events)
+    is_link = physsim["link"].notna() & physsim["time"].notna()
+    links = physsim.loc[is_link, ["vehicle", "time", "link"]]
+
+    # Encode vehicles of both tables with shared codes to sort on (vehicle, time)
+    vehicles = pd.Categorical(
+        np.concatenate([links["vehicle"].astype(str), windows["vehicle"].astype(str)])
+    ).codes.astype(np.float64)
+    link_vehicle, window_vehicle = vehicles[: len(links)], vehicles[len(links) :]
+    span = np.nanmax([links["time"].max(), windows["arrival"].max(), 0.0]) + 1
+    key = link_vehicle * span + links["time"].to_numpy(dtype=float)
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+
+    # Half-open ranges of link events of each window, including its bounds
+    lower = np.searchsorted(key, window_vehicle * span + windows["departure"].to_numpy(), "left")
+    upper = np.searchsorted(key, window_vehicle * span + windows["arrival"].to_numpy(), "right")
+    counts = upper - lower
+    window_index = np.repeat(np.arange(len(windows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    event_index = order[np.repeat(lower, counts) + offsets]
+
+    routes = windows.iloc[window_index].reset_index(drop=True)
+    routes["time"] = links["time"].to_numpy()[event_index]
+    routes["link"] = links["link"].to_numpy()[event_index].astype(np.int64)
+
+    # Collapse consecutive events on the same link within a leg
+    first = np.ones(len(routes), dtype=bool)
+    first[1:] = (np.diff(window_index) != 0) | (np.diff(routes["link"].to_numpy()) != 0)
+    routes = routes[first].reset_index(drop=True)
+    routes["sequence"] = routes.groupby(["person", "leg"], observed=True).cumcount()
+    return routes[ROUTE_COLUMNS]
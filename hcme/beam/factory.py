@@ -4,16 +4,86 @@ Factories are responsible for building templated inputs.
 Factory outputs can be used to create test fixtures, or ready-to-use BEAM input files.
 """
 
+import gzip
+import hashlib
+import itertools
+import os
+import shutil
+import time
 from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    PackageLoader,
+    select_autoescape,
+)
 from loguru import logger
 
 from .constants import InputRegistry as INPUTS
+from .incremental import BATCH_SIZE as CACHE_BATCH_SIZE
+from .incremental import FragmentCache, record_hash
+from .serializers import serializer_registry, write_document
+
+# Directory of compiled templates, set to an empty string to disable caching
+TEMPLATE_CACHE_ENV = "HCME_TEMPLATE_CACHE"
+
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache which only creates its directory when the first template is compiled.
+
+    Templates are compiled without caching when the directory is not writable.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.writable = True
+
+    def get_bucket(self, environment, name, filename, source):
+        # Whether values are escaped is compiled into the bytecode, so it is part of the checksum
+        autoescape = environment.autoescape
+        if callable(autoescape):
+            autoescape = autoescape(name)
+        return super().get_bucket(environment, name, filename, f"{autoescape}:{source}")
+
+    def load_bytecode(self, bucket) -> None:
+        try:
+            super().load_bytecode(bucket)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket) -> None:
+        if not self.writable:
+            return
+        try:
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError:
+            logger.warning("Template cache {directory} is not writable", directory=self.directory)
+            self.writable = False
+
+
+def bytecode_cache(directory: str = None) -> Optional[FileSystemBytecodeCache]:
+    """On-disk cache of compiled templates shared across processes and invocations.
+
+    Jinja keys cached bytecode by template name and a checksum of the template source, so
+    edited templates are compiled again.  The directory defaults to ``HCME_TEMPLATE_CACHE``
+    or ``$XDG_CACHE_HOME/hcme/templates`` and is created on first use.
+    """
+    if directory is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+        directory = os.environ.get(TEMPLATE_CACHE_ENV, Path(cache_home) / "hcme" / "templates")
+    if not directory:
+        return None
+    return LazyBytecodeCache(str(directory))
+
 
 template_env = Environment(
     loader=PackageLoader("hcme.beam", "templates"),
-    autoescape=select_autoescape(["xml"]),
+    autoescape=select_autoescape(["xml", "xml.j2"]),
+    bytecode_cache=bytecode_cache(),
 )
 
 
@@ -25,6 +95,26 @@ template_registry = {
     INPUTS.NETWORK.value: "physsim-network.xml.j2",
 }
 
+# Name of the template block which renders the repeated records of a document.  Documents
+# can be assembled from separately rendered record fragments in between its frame.
+RECORDS_BLOCK = "records"
+
+_FRAGMENT_MARKER = "\x00"
+
+# gzip compression level for outputs ending with ".gz"
+DEFAULT_COMPRESSLEVEL = 6
+
+# Number of template events joined into a single write when streaming documents
+DEFAULT_BUFFER_SIZE = 64
+
+# Serializer backends used to write documents
+JINJA = "jinja"
+LXML = "lxml"
+
+# Key of the records rendered by each template in the template data
+record_keys = {name: key for name, (key, _) in serializer_registry.items()}
+record_keys[INPUTS.NETWORK.value] = "links"
+
 DEFAULT_NS = "default"
 
 template_namespaces = {
@@ -36,27 +126,262 @@ template_namespaces = {
 }
 
 
+def open_output(path: str, mode: str = "w", compresslevel: int = DEFAULT_COMPRESSLEVEL):
+    """Open an output for writing, streaming through gzip when the path ends with ``.gz``.
+
+    Args:
+        path: Output path.
+        mode: ``"w"`` for text or ``"wb"`` for bytes.
+        compresslevel: gzip compression level from 0 to 9.
+    """
+    if compresslevel is None:
+        compresslevel = DEFAULT_COMPRESSLEVEL
+    path = str(path)
+    binary = "b" in mode
+    if path.endswith(".gz"):
+        if binary:
+            return gzip.open(path, mode, compresslevel=compresslevel)
+        return gzip.open(path, f"{mode}t", compresslevel=compresslevel, encoding="utf-8")
+    return open(path, mode) if binary else open(path, mode, encoding="utf-8")
+
+
+class TimedIterator:
+    """Iterate over records, accounting for the time spent waiting on each one."""
+
+    def __init__(self, records: Iterable):
+        self.records = iter(records)
+        self.count = 0
+        self.wait = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            record = next(self.records)
+        finally:
+            self.wait += time.perf_counter() - start
+        self.count += 1
+        return record
+
+
+def record_write_summary(summary: dict) -> None:
+    """Record a write summary with `hcme.metrics.Recorder`."""
+    # Imported here so that rendering does not require a database connection
+    from hcme.metrics import Recorder
+
+    recorder = Recorder(
+        name=f"write-{summary['template']}",
+        domain="beam",
+        description="Throughput of writing a BEAM input file",
+        provenance=__name__,
+    )
+    recorder.record(summary)
+
+
 @dataclass
 class TemplateLoader:
+    """Render a BEAM input template with its data.
+
+    Attributes:
+        buffer_size: Number of template events joined into each write of a Jinja stream.
+        record_metrics: Record the summary of each write with `hcme.metrics.Recorder`.
+    """
 
     template: str
     data: dict
+    backend: str = JINJA
+    compresslevel: int = DEFAULT_COMPRESSLEVEL
+    buffer_size: int = DEFAULT_BUFFER_SIZE
+    record_metrics: bool = False
 
     def __post_init__(self):
         self.template_name = self.template
-        self.template = template_env.get_template(
-            template_registry.get(self.template_name)
-        )
+        self.template = template_env.get_template(template_registry.get(self.template_name))
+        if self.backend == LXML and self.template_name not in serializer_registry:
+            raise ValueError(f"No {LXML} serializer for {self.template_name}")
 
-    def write(self, output: str = None):
+    def write(self, output: str = None) -> dict:
+        """Write the document and return a summary of its throughput.
+
+        Time spent waiting on the records iterator, e.g. on database queries, is reported
+        separately from the time spent rendering and writing.
+        """
         logger.info(
-            "Generating {template_name} to {f}",
+            "Generating {template_name} to {f} with {backend}",
             f=output,
             template_name=self.template_name,
+            backend=self.backend,
+        )
+        data = dict(self.data)
+        key = record_keys.get(self.template_name)
+        records = TimedIterator(data.get(key) or [])
+        if key is not None:
+            data[key] = records
+
+        start = time.perf_counter()
+        if self.backend == LXML:
+            with open_output(output, "wb", self.compresslevel) as fh:
+                write_document(fh, self.template_name, self.frame(), data)
+        else:
+            stream = self.template.stream(**data)
+            # Jinja only buffers more than one event at a time
+            if self.buffer_size and self.buffer_size > 1:
+                stream.enable_buffering(self.buffer_size)
+            with open_output(output, "w", self.compresslevel) as fh:
+                stream.dump(fh)
+        elapsed = time.perf_counter() - start
+
+        size = os.path.getsize(output)
+        summary = {
+            "template": self.template_name,
+            "backend": self.backend,
+            "records": records.count,
+            "bytes": size,
+            "seconds": elapsed,
+            "wait_seconds": records.wait,
+            "render_seconds": elapsed - records.wait,
+            "records_per_second": records.count / elapsed if elapsed else 0.0,
+            "bytes_per_second": size / elapsed if elapsed else 0.0,
+        }
+        logger.bind(**summary).info(
+            "Generated {template} to {f}: {records} records at {records_per_second:,.0f}/s, "
+            "{bytes_per_second:,.0f} B/s, {wait_seconds:.1f}s waiting on records and "
+            "{render_seconds:.1f}s rendering",
+            f=output,
+            **summary,
         )
-        stream = self.template.stream(**self.data)
-        stream.dump(output)
+        if self.record_metrics:
+            record_write_summary(summary)
+        return summary
 
     def render(self):
         document = self.template.render(**self.data)
         return document
+
+    def write_fragment(self, output: str):
+        """Write only the records of the document, without its header and closing tags."""
+        logger.info(
+            "Generating {template_name} fragment to {f}",
+            f=output,
+            template_name=self.template_name,
+        )
+        render_records = self.template.blocks[RECORDS_BLOCK]
+        with open(output, "w", encoding="utf-8") as fh:
+            fh.writelines(render_records(self.template.new_context(self.data)))
+
+    def write_incremental(
+        self,
+        output: str,
+        cache: str,
+        digests: Iterable[Tuple] = None,
+        fetch: Callable[[List], Iterable[dict]] = None,
+    ) -> dict:
+        """Write the document, re-rendering only records which changed since the last write.
+
+        Without ``digests`` every record of the template data is hashed.  With ``digests``
+        the records are only fetched, and rendered, when their hash changed.
+
+        Args:
+            output: Output path.
+            cache: Path of the fragment cache of this document.
+            digests: ``(id, hash)`` of every record in document order, hashed from the
+                rows the records are built from.
+            fetch: Called with the ids of changed records and returns those records, in
+                any order.  Required with ``digests``.
+
+        Returns:
+            Number of records rendered, reused from the cache and removed from the cache.
+        """
+        head, tail = self.frame()
+        version = self.checksum()
+        with FragmentCache(cache, version) as fragments, open_output(
+            output, "w", self.compresslevel
+        ) as fh:
+            if fragments.invalidated:
+                logger.info("Template of {f} changed, rendering every record", f=output)
+            fh.write(head)
+            if digests is None:
+                stats = self._write_hashed(fh, fragments)
+            else:
+                stats = self._write_digested(fh, fragments, digests, fetch)
+            fh.write(tail)
+        stats["removed"] = fragments.removed
+        logger.info(
+            "Generated {template_name} to {f}: {rendered} rendered, {cached} cached",
+            f=output,
+            template_name=self.template_name,
+            **stats,
+        )
+        return stats
+
+    def checksum(self) -> str:
+        """Checksum of the template source and backend which records are rendered with."""
+        source, _, _ = template_env.loader.get_source(template_env, self.template.name)
+        autoescape = template_env.autoescape(self.template.name)
+        payload = f"{self.backend}:{autoescape}:{source}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _render_record(self, record: dict) -> str:
+        key = record_keys[self.template_name]
+        context = self.template.new_context({**self.data, key: [record]})
+        return "".join(self.template.blocks[RECORDS_BLOCK](context))
+
+    def _write_hashed(self, fh, fragments: FragmentCache) -> dict:
+        """Write the records of the template data, hashing each record."""
+        stats = {"rendered": 0, "cached": 0}
+        records = iter(self.data[record_keys[self.template_name]])
+        for batch in iter(lambda: list(itertools.islice(records, CACHE_BATCH_SIZE)), []):
+            digests = [(record["id"], record_hash(record)) for record in batch]
+            stale = set(fragments.stale(digests))
+            rendered = [
+                (record_id, digest, self._render_record(record))
+                for (record_id, digest), record in zip(digests, batch)
+                if record_id in stale
+            ]
+            fragments.put(rendered)
+            fh.writelines(fragments.read([record_id for record_id, _ in digests]))
+            stats["rendered"] += len(rendered)
+            stats["cached"] += len(batch) - len(rendered)
+        return stats
+
+    def _write_digested(self, fh, fragments: FragmentCache, digests, fetch) -> dict:
+        """Fetch and render changed records only, then write every record from the cache."""
+        ids, stale = [], {}
+        digests = iter(digests)
+        for batch in iter(lambda: list(itertools.islice(digests, CACHE_BATCH_SIZE)), []):
+            ids.extend(record_id for record_id, _ in batch)
+            changed = set(fragments.stale(batch))
+            stale.update((record_id, d) for record_id, d in batch if record_id in changed)
+
+        if stale:
+            records = iter(fetch(list(stale)))
+            for batch in iter(lambda: list(itertools.islice(records, CACHE_BATCH_SIZE)), []):
+                fragments.put(
+                    (record["id"], stale[record["id"]], self._render_record(record))
+                    for record in batch
+                )
+
+        for start in range(0, len(ids), CACHE_BATCH_SIZE):
+            fh.writelines(fragments.read(ids[start : start + CACHE_BATCH_SIZE]))
+        return {"rendered": len(stale), "cached": len(ids) - len(stale)}
+
+    def frame(self) -> Tuple[str, str]:
+        """Document text before and after the records block."""
+        wrapper = template_env.from_string(
+            f'{{% extends "{self.template.name}" %}}'
+            f"{{% block {RECORDS_BLOCK} %}}{_FRAGMENT_MARKER}{{% endblock %}}"
+        )
+        head, tail = wrapper.render(**self.data).split(_FRAGMENT_MARKER)
+        return head, tail
+
+    def stitch(self, output: str, fragments: Iterable[str]):
+        """Assemble a document from record fragments written in document order."""
+        head, tail = self.frame()
+        with open_output(output, "w", self.compresslevel) as fh:
+            fh.write(head)
+            for fragment in fragments:
+                with open(fragment, encoding="utf-8") as src:
+                    shutil.copyfileobj(src, fh)
+            fh.write(tail)
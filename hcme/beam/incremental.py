@@ -0,0 +1,93 @@
+"""
+Cache of rendered record fragments for incremental rebuilds of BEAM inputs.
+
+Each record (e.g. a person with its plan) has a hash of everything it is built from.
+Only records whose hash differs from the cached one need to be rendered again.  Hashes
+are either computed from the source rows, e.g. by the database, or from the records.
+"""
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+# Records looked up in the cache per query, below SQLite's limit of query parameters
+BATCH_SIZE = 500
+
+
+def record_hash(record: Dict) -> str:
+    """Content hash of a record as rendered by the templates."""
+    payload = json.dumps(record, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class FragmentCache:
+    """Rendered fragments keyed by record id, stored in a SQLite file.
+
+    Lookups take a batch of ids at a time, see ``BATCH_SIZE``.
+
+    Args:
+        path: Path of the SQLite file.
+        version: Checksum of how fragments are rendered, e.g. of the template source.
+            Every fragment is dropped when it differs from the version of the cache.
+    """
+
+    def __init__(self, path: str, version: str = ""):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fragments "
+            "(id TEXT PRIMARY KEY, hash TEXT NOT NULL, fragment TEXT NOT NULL, seen INTEGER)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (version TEXT NOT NULL)")
+        row = self.connection.execute("SELECT version FROM meta").fetchone()
+        self.invalidated = row is not None and row[0] != version
+        if row is None or self.invalidated:
+            self.connection.execute("DELETE FROM fragments")
+            self.connection.execute("DELETE FROM meta")
+            self.connection.execute("INSERT INTO meta VALUES (?)", (version,))
+        self.connection.execute("UPDATE fragments SET seen = 0")
+        self.removed = 0
+
+    def _select(self, columns: str, ids: List[str]) -> List[tuple]:
+        placeholders = ",".join("?" * len(ids))
+        return self.connection.execute(
+            f"SELECT id, {columns} FROM fragments WHERE id IN ({placeholders})", ids
+        ).fetchall()
+
+    def stale(self, digests: Sequence[Tuple[Any, str]]) -> List:
+        """Ids of the ``(id, hash)`` pairs whose cached fragment is missing or outdated."""
+        hashes = dict(self._select("hash", [str(record_id) for record_id, _ in digests]))
+        return [record_id for record_id, digest in digests if hashes.get(str(record_id)) != digest]
+
+    def read(self, ids: Sequence) -> List[str]:
+        """Cached fragments of ``ids`` in the given order, marking them as written."""
+        ids = [str(record_id) for record_id in ids]
+        fragments = dict(self._select("fragment", ids))
+        placeholders = ",".join("?" * len(ids))
+        self.connection.execute(f"UPDATE fragments SET seen = 1 WHERE id IN ({placeholders})", ids)
+        return [fragments[record_id] for record_id in ids]
+
+    def put(self, rows: Iterable[Tuple[Any, str, str]]) -> None:
+        """Store ``(id, hash, fragment)`` rows."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO fragments (id, hash, fragment, seen) VALUES (?, ?, ?, 1)",
+            ((str(record_id), digest, fragment) for record_id, digest, fragment in rows),
+        )
+
+    def close(self) -> None:
+        """Drop fragments of records which were not written since the cache was opened."""
+        self.removed = self.connection.execute("DELETE FROM fragments WHERE seen = 0").rowcount
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.connection.rollback()
+            self.connection.close()
@@ -0,0 +1,196 @@
+"""
+In-memory geometry of the physsim network.
+
+`LinkGeometryStore` keeps node coordinates in a contiguous array and the end nodes of
+each link as indices into it, so that routes are turned into polylines by array
+indexing instead of querying ``models.Link.geometry`` for every link:
+
+    .. code-block:: python
+
+        store = LinkGeometryStore.load_or_build("data/output/network-geometry")
+        for polyline in store.polylines([[12, 13, 14], [20, 21]]):
+            lon, lat = polyline.T
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from lxml import etree
+
+# Arrays of a store, saved as ``<name>.npy``
+ARRAYS = ["node_ids", "node_xy", "link_ids", "link_from", "link_to"]
+
+
+def _lookup(sorted_ids: np.ndarray, ids: Sequence[int], name: str) -> np.ndarray:
+    """Positions of ``ids`` in ``sorted_ids``, raising a `KeyError` for unknown ids."""
+    ids = np.asarray(ids, dtype=np.int64)
+    index = np.searchsorted(sorted_ids, ids)
+    index = np.minimum(index, len(sorted_ids) - 1)
+    unknown = sorted_ids[index] != ids
+    if unknown.any():
+        raise KeyError(f"Unknown {name} {ids[unknown][:10].tolist()}")
+    return index
+
+
+@dataclass
+class LinkGeometryStore:
+    """Node coordinates and link end nodes of a network, sorted by id.
+
+    Attributes:
+        node_ids: Sorted node ids.
+        node_xy: Coordinates of each node as ``(x, y)``, in EPSG:4326 unless stated.
+        link_ids: Sorted link ids.
+        link_from: Index into ``node_xy`` of the start node of each link.
+        link_to: Index into ``node_xy`` of the end node of each link.
+    """
+
+    node_ids: np.ndarray
+    node_xy: np.ndarray
+    link_ids: np.ndarray
+    link_from: np.ndarray
+    link_to: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, node_ids, x, y, link_ids, from_node_ids, to_node_ids):
+        """Build a store from unsorted node and link columns.
+
+        Raises:
+            ValueError: If there are no nodes or no links.
+            KeyError: If links start or end at unknown nodes.
+        """
+        if len(node_ids) == 0 or len(link_ids) == 0:
+            raise ValueError("Cannot build a link geometry store without nodes and links")
+        node_order = np.argsort(node_ids)
+        node_ids = np.asarray(node_ids, dtype=np.int64)[node_order]
+        node_xy = np.column_stack([x, y]).astype(np.float64)[node_order]
+        link_order = np.argsort(link_ids)
+        from_node_ids = np.asarray(from_node_ids, dtype=np.int64)[link_order]
+        to_node_ids = np.asarray(to_node_ids, dtype=np.int64)[link_order]
+        return cls(
+            node_ids=node_ids,
+            node_xy=np.ascontiguousarray(node_xy),
+            link_ids=np.asarray(link_ids, dtype=np.int64)[link_order],
+            link_from=_lookup(node_ids, from_node_ids, "link start nodes"),
+            link_to=_lookup(node_ids, to_node_ids, "link end nodes"),
+        )
+
+    @classmethod
+    def from_db(cls) -> "LinkGeometryStore":
+        """Load the ``nodes`` and ``links`` tables in two queries."""
+        # Imported here so that stores loaded from files do not need a database
+        import geoalchemy2 as ga
+        import sqlalchemy as sa
+
+        from hcme.db import Session, models
+
+        session = Session()
+        nodes = session.execute(
+            sa.select(
+                models.Node.id,
+                ga.functions.ST_X(models.Node.coordinates),
+                ga.functions.ST_Y(models.Node.coordinates),
+            )
+        ).all()
+        links = session.execute(
+            sa.select(models.Link.id, models.Link.from_node_id, models.Link.to_node_id)
+        ).all()
+        session.close()
+        return cls.from_rows(nodes, links)
+
+    @classmethod
+    def from_rows(cls, nodes: Sequence[tuple], links: Sequence[tuple]) -> "LinkGeometryStore":
+        """Build a store from ``(id, x, y)`` node rows and ``(id, from, to)`` link rows."""
+        if not nodes or not links:
+            raise ValueError("Cannot build a link geometry store without nodes and links")
+        return cls.from_arrays(*zip(*nodes), *zip(*links))
+
+    @classmethod
+    def from_network_file(cls, path: str, crs=None) -> "LinkGeometryStore":
+        """Load a physsim network file, projecting node coordinates to EPSG:4326.
+
+        Args:
+            crs: CRS of the network file, UTM zone 10 by default.  Coordinates are kept
+                as they are when ``False``.
+        """
+        node_ids, x, y, link_ids, from_node_ids, to_node_ids = [], [], [], [], [], []
+        for _, element in etree.iterparse(str(path), tag=("node", "link"), load_dtd=False):
+            if element.tag == "node":
+                node_ids.append(int(element.get("id")))
+                x.append(float(element.get("x")))
+                y.append(float(element.get("y")))
+            else:
+                link_ids.append(int(element.get("id")))
+                from_node_ids.append(int(element.get("from")))
+                to_node_ids.append(int(element.get("to")))
+            # Drop parsed elements so that the tree does not grow with the network
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        if crs is not False:
+            from pyproj import Transformer
+
+            from hcme.crs import UTM10
+
+            transformer = Transformer.from_crs(crs or UTM10.crs, "EPSG:4326", always_xy=True)
+            x, y = transformer.transform(np.asarray(x), np.asarray(y))
+        return cls.from_arrays(node_ids, x, y, link_ids, from_node_ids, to_node_ids)
+
+    def save(self, directory: str) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "LinkGeometryStore":
+        """Load a saved store, memory mapping its arrays by default."""
+        mmap_mode = "r" if mmap else None
+        return cls(
+            **{
+                name: np.load(Path(directory) / f"{name}.npy", mmap_mode=mmap_mode)
+                for name in ARRAYS
+            }
+        )
+
+    @classmethod
+    def load_or_build(cls, directory: str) -> "LinkGeometryStore":
+        """Load a saved store, building it from the database on first use."""
+        if all((Path(directory) / f"{name}.npy").exists() for name in ARRAYS):
+            return cls.load(directory)
+        logger.info("Building link geometry store in {directory}", directory=directory)
+        store = cls.from_db()
+        store.save(directory)
+        return store
+
+    def link_index(self, link_ids: Sequence[int]) -> np.ndarray:
+        """Positions of links in the store, raising a `KeyError` for unknown links."""
+        return _lookup(self.link_ids, link_ids, "links")
+
+    def polylines(self, routes: Iterable[Sequence[int]]) -> List[np.ndarray]:
+        """Ordered ``(n, 2)`` coordinates of each route, given as a sequence of link ids.
+
+        Nodes shared by consecutive links are only included once.
+        """
+        routes = [np.asarray(route, dtype=np.int64) for route in routes]
+        if not routes:
+            return []
+        lengths = np.array([len(route) for route in routes])
+        links = self.link_index(np.concatenate(routes))
+
+        # Start and end node of every link, then drop nodes repeated along a route
+        nodes = np.column_stack([self.link_from[links], self.link_to[links]]).ravel()
+        route_index = np.repeat(np.arange(len(routes)), lengths * 2)
+        keep = np.ones(len(nodes), dtype=bool)
+        keep[1:] = (nodes[1:] != nodes[:-1]) | (route_index[1:] != route_index[:-1])
+        counts = np.bincount(route_index[keep], minlength=len(routes))
+        return np.split(self.node_xy[nodes[keep]], np.cumsum(counts)[:-1])
+
+    def line_coordinates(self, polylines: List[np.ndarray]) -> Tuple[list, list]:
+        """Longitudes and latitudes of polylines separated by ``None``, as used by plotly."""
+        lons, lats = [], []
+        for polyline in polylines:
+            lons.extend(polyline[:, 0].tolist() + [None])
+            lats.extend(polyline[:, 1].tolist() + [None])
+        return lons, lats
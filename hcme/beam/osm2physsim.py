@@ -1,31 +1,181 @@
 # Converts an OSM file to a physsim-network.xml input
+from typing import Dict, Iterable
+
+import click
+import numpy as np
 import pandas as pd
-from lxml import etree
+from loguru import logger
+from pyproj import Transformer
 from pyrosm import OSM
 
+from hcme.beam.constants import InputRegistry as INPUTS
+from hcme.beam.factory import TemplateLoader
+from hcme.beam.simplify import simplify_links
+
 # Miles per hour to meters per second
 mph_to_mps = 0.44704
 
+# Kilometers per hour to meters per second, OSM speeds without a unit are in km/h
+kph_to_mps = 1 / 3.6
+
+# Records rendered per chunk when streaming nodes and links to the network file
+CHUNK_SIZE = 10000
+
+# Defaults by OSM highway type: (freespeed in mph, lanes per direction, capacity per lane
+# in vehicles per hour)
+highway_defaults = {
+    "motorway": (65, 2, 2000),
+    "motorway_link": (45, 1, 1500),
+    "trunk": (55, 2, 2000),
+    "trunk_link": (40, 1, 1500),
+    "primary": (45, 1, 1500),
+    "primary_link": (35, 1, 1500),
+    "secondary": (35, 1, 1000),
+    "secondary_link": (30, 1, 1000),
+    "tertiary": (30, 1, 600),
+    "tertiary_link": (25, 1, 600),
+    "unclassified": (25, 1, 600),
+    "residential": (25, 1, 600),
+    "living_street": (15, 1, 300),
+    "service": (15, 1, 300),
+}
+DEFAULT_HIGHWAY = (15, 1, 300)
+
+# Highway types which cars may not use
+walk_highways = {"footway", "path", "pedestrian", "steps", "cycleway", "bridleway", "corridor"}
+
+ONEWAY = {"yes", "true", "1"}
+REVERSED_ONEWAY = {"-1", "reverse"}
+
+
+def project(lon: np.ndarray, lat: np.ndarray, from_crs: str, to_crs: str):
+    """Project coordinate columns in a single vectorized transform."""
+    transformer = Transformer.from_crs(from_crs, to_crs, always_xy=True)
+    return transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+
+
+def parse_speed(maxspeed: pd.Series) -> pd.Series:
+    """Parse OSM ``maxspeed`` tags such as "35 mph" or "50" to meters per second."""
+    maxspeed = maxspeed.astype("string").str.split(";").str[0].str.strip()
+    value = pd.to_numeric(maxspeed.str.extract(r"^(\d+(?:\.\d+)?)")[0], errors="coerce")
+    is_mph = maxspeed.str.endswith("mph").fillna(False).to_numpy(dtype=bool)
+    return value * np.where(is_mph, mph_to_mps, kph_to_mps)
+
+
+def parse_lanes(lanes: pd.Series) -> pd.Series:
+    """Parse OSM ``lanes`` tags such as "2" or "2;3" to numbers."""
+    lanes = lanes.astype("string").str.split(";").str[0]
+    return pd.to_numeric(lanes, errors="coerce")
+
+
+def link_attributes(links: pd.DataFrame) -> pd.DataFrame:
+    """Derive link attributes of both directions of each OSM edge in columnar form.
 
-def main(fp: str, from_crs: str = "EPSG:4326", to_crs: str = "EPSG:26910"):
+    Args:
+        links: OSM edges with ``id``, ``u``, ``v``, ``length``, ``highway``,
+            ``maxspeed``, ``lanes`` and ``oneway`` columns.
+
+    Returns:
+        One row per directed link with the columns used by the network template.  Two-way
+        roads get a reverse link and lanes are split between both directions.
+    """
+    highway = links["highway"].astype("string").fillna("").to_numpy(dtype=object)
+    defaults = np.array(
+        [highway_defaults.get(h, DEFAULT_HIGHWAY) for h in highway], dtype=float
+    ).reshape(-1, 3)
+
+    oneway = links["oneway"].astype("string").str.lower().fillna("no")
+    is_reversed = oneway.isin(REVERSED_ONEWAY).to_numpy(dtype=bool)
+    is_oneway = oneway.isin(ONEWAY).to_numpy(dtype=bool) | is_reversed
+    is_oneway |= np.isin(highway, ["motorway", "motorway_link"])
+
+    lanes = parse_lanes(links["lanes"]).to_numpy(dtype=float)
+    # Lanes of two-way roads are tagged for both directions
+    lanes = np.where(is_oneway, lanes, np.floor(lanes / 2))
+    permlanes = np.fmax(np.where(np.isnan(lanes), defaults[:, 1], lanes), 1)
+
+    freespeed = parse_speed(links["maxspeed"]).to_numpy(dtype=float)
+    freespeed = np.where(np.isnan(freespeed), defaults[:, 0] * mph_to_mps, freespeed)
+
+    u = links["u"].to_numpy()
+    v = links["v"].to_numpy()
+    forward = pd.DataFrame(
+        {
+            "u": np.where(is_reversed, v, u),
+            "v": np.where(is_reversed, u, v),
+            "origid": links["id"].to_numpy(),
+            "length": links["length"].to_numpy(dtype=float),
+            "freespeed": freespeed,
+            "capacity": defaults[:, 2] * permlanes,
+            "permlanes": permlanes,
+            "highwayType": highway,
+            "modes": np.where(np.isin(highway, list(walk_highways)), "walk", "car,walk"),
+        }
+    )
+    backward = forward[~is_oneway].rename(columns={"u": "v", "v": "u"})
+    network = pd.concat([forward, backward], ignore_index=True)
+    network.insert(0, "id", np.arange(len(network)))
+    return network
+
+
+def iter_records(df: pd.DataFrame, chunksize: int = CHUNK_SIZE) -> Iterable[Dict]:
+    """Stream the rows of a frame as dicts, materializing ``chunksize`` rows at a time."""
+    for start in range(0, len(df), chunksize):
+        yield from df.iloc[start : start + chunksize].to_dict(orient="records")
+
+
+def main(
+    fp: str,
+    output: str,
+    from_crs: str = "EPSG:4326",
+    to_crs: str = "EPSG:26910",
+    network_type: str = "all",
+    link_mapping: str = None,
+):
     """
     Convert an open street maps pbf file (.osm.pbf) to a matsim network file.
 
     Args:
         fp (str): Path or pathlike to the osm file.
+        output (str): Path of the network file, compressed with gzip when it ends with
+            ``.gz``.
+        network_type (str): pyrosm network type, e.g. ``"driving"``.
+        link_mapping (str): Merge chains of links through degree-2 nodes and write the
+            mapping of merged links to the unsimplified links to this csv, see
+            `hcme.beam.simplify`.
     """
     osm = OSM(fp)
 
-    # Read the OSM file into a Geopandas DataFrame
-    nodes, links = osm.get_network(nodes=True, network_type="all")
+    # Read the OSM file and keep plain columns only, geometries are not needed
+    nodes, links = osm.get_network(nodes=True, network_type=network_type)
+    nodes = pd.DataFrame({"id": nodes["id"], "lon": nodes["lon"], "lat": nodes["lat"]})
+    columns = ["id", "u", "v", "length", "highway", "maxspeed", "lanes", "oneway"]
+    links = pd.DataFrame({c: links[c] if c in links else None for c in columns})
+    logger.info("Read {n} nodes and {m} edges from {fp}", n=len(nodes), m=len(links), fp=fp)
+
+    nodes["x"], nodes["y"] = project(nodes.pop("lon"), nodes.pop("lat"), from_crs, to_crs)
+    links = link_attributes(links)
+    if link_mapping:
+        links, mapping = simplify_links(links)
+        mapping.to_csv(link_mapping, index=False)
+        nodes = nodes[nodes["id"].isin(links["u"]) | nodes["id"].isin(links["v"])]
+
+    loader = TemplateLoader(
+        INPUTS.NETWORK.value, {"nodes": iter_records(nodes), "links": iter_records(links)}
+    )
+    return loader.write(output)
 
-    # Convert geometry to target CRS
-    nodes = nodes.set_crs(from_crs).to_crs(to_crs)
 
-    # Create nodes dictionary
-    nodes["x"] = nodes.geometry.x
-    nodes["y"] = nodes.geometry.y
+@click.command()
+@click.argument("fp", type=click.Path(exists=True))
+@click.argument("output", type=click.Path())
+@click.option("--to-crs", default="EPSG:26910", show_default=True)
+@click.option("--network-type", default="all", show_default=True)
+@click.option("--link-mapping", type=click.Path(), help="Simplify the network, see main.")
+def cli(fp, output, to_crs, network_type, link_mapping):
+    """Convert an OSM pbf file to a BEAM physsim network."""
+    main(fp, output, to_crs=to_crs, network_type=network_type, link_mapping=link_mapping)
 
-    nodes = nodes[["id", "x", "y"]].to_dict(orient="records")
 
-    links = links[["id", "u", "v", "length", "freespeed", "highway"]]
+if __name__ == "__main__":
+    cli()
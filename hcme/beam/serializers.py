@@ -0,0 +1,164 @@
+"""
+Incremental XML serializers for BEAM inputs built on ``lxml.etree.xmlfile``.
+
+Serializers are an alternative to the Jinja templates in ``hcme/beam/templates`` and
+produce byte-identical documents: the document frame (declaration, DOCTYPE and root
+element) is taken from the rendered template and only the records are written by lxml,
+reproducing the template whitespace.
+
+Note:
+    Both backends escape ``&``, ``<`` and ``>``.  Jinja also escapes quotes, as ``&#34;``
+    and ``&#39;``, while lxml only escapes ``"`` in attributes, as ``&quot;``.  Documents
+    with values containing quotes are equal once parsed but not byte-identical.
+"""
+import re
+from typing import Callable, Dict, Iterable, Tuple
+
+from lxml import etree
+
+from .constants import InputRegistry as INPUTS
+
+ACTIVITY_KEYS = ["type", "x", "y", "end_time"]
+
+# Whitespace written before an element at each level of nesting in the templates
+INDENT = ["\n" + " " * 4 * level for level in range(4)]
+
+_ATTRIBUTE = re.compile(r'([\w:.-]+)="([^"]*)"')
+
+
+def _text(record: Dict, key: str) -> str:
+    """Format a value the same way the templates do, where missing values are empty."""
+    return str(record[key]) if key in record else ""
+
+
+def write_population(xf, population: Iterable[Dict]):
+    for person in population:
+        with xf.element("person", id=_text(person, "id")):
+            xf.write(INDENT[2])
+            if person.get("attributes"):
+                with xf.element("attributes"):
+                    xf.write(INDENT[3])
+                    for attribute in person["attributes"]:
+                        attrib = {
+                            "name": _text(attribute, "name"),
+                            "class": _text(attribute, "type"),
+                        }
+                        with xf.element("attribute", attrib):
+                            xf.write(_text(attribute, "value"))
+                    xf.write(INDENT[2])
+            xf.write(INDENT[2])
+            if person.get("plan"):
+                with xf.element("plan", selected="yes"):
+                    for activity in person["plan"]:
+                        if activity.get("mode"):
+                            xf.write(INDENT[3])
+                            with xf.element("leg", mode=str(activity["mode"])):
+                                pass
+                        xf.write(INDENT[3])
+                        attrib = {k: str(activity[k]) for k in ACTIVITY_KEYS if k in activity}
+                        with xf.element("activity", attrib):
+                            pass
+                    xf.write(INDENT[2])
+            xf.write(INDENT[1])
+
+
+def write_households(xf, households: Iterable[Dict]):
+    for household in households:
+        with xf.element("household", id=_text(household, "id")):
+            xf.write(INDENT[2])
+            if household.get("members"):
+                with xf.element("members"):
+                    xf.write(INDENT[3])
+                    for person_id in household["members"]:
+                        xf.write(etree.Element("personId", refId=str(person_id)))
+                    xf.write(INDENT[2])
+            xf.write(INDENT[2])
+            if household.get("vehicles"):
+                with xf.element("vehicles"):
+                    xf.write(INDENT[3])
+                    for vehicle_id in household["vehicles"]:
+                        xf.write(etree.Element("vehicleDefinitionId", refId=str(vehicle_id)))
+                    xf.write(INDENT[2])
+            xf.write(INDENT[2])
+            if household.get("income"):
+                attrib = {
+                    "currency": str(household.get("income_currency") or "usd"),
+                    "period": str(household.get("income_period") or "year"),
+                }
+                with xf.element("income", attrib):
+                    xf.write(str(household["income"]))
+            xf.write(INDENT[1])
+
+
+def write_population_attributes(xf, population: Iterable[Dict]):
+    for person in population:
+        xf.write(INDENT[1])
+        with xf.element("object", id=_text(person, "id")):
+            xf.write(INDENT[2])
+            with xf.element("attribute", {"name": "excluded-modes", "class": "java.lang.String"}):
+                if person.get("excluded_modes"):
+                    xf.write('"' + ",".join(map(str, person["excluded_modes"])) + '"')
+            xf.write(INDENT[2])
+            with xf.element("attribute", {"name": "rank", "class": "java.lang.Integer"}):
+                xf.write(_text(person, "rank"))
+            xf.write(INDENT[1])
+        xf.write(INDENT[1])
+
+
+def write_household_attributes(xf, households: Iterable[Dict]):
+    for household in households:
+        with xf.element("object", id=_text(household, "id")):
+            for name, cls in [
+                ("homecoordx", "java.lang.Double"),
+                ("homecoordy", "java.lang.Double"),
+            ]:
+                xf.write(INDENT[2])
+                with xf.element("attribute", {"name": name, "class": cls}):
+                    xf.write(_text(household, name))
+            xf.write(INDENT[2])
+            with xf.element("attribute", {"name": "housingtype", "class": "java.lang.String"}):
+                xf.write("House")
+            xf.write(INDENT[1])
+
+
+# Registry key -> (key of the records in the template data, records serializer)
+serializer_registry: Dict[str, Tuple[str, Callable]] = {
+    INPUTS.POPULATION.value: ("population", write_population),
+    INPUTS.HOUSEHOLDS.value: ("households", write_households),
+    INPUTS.POPULATIONATTRIBUTES.value: ("population", write_population_attributes),
+    INPUTS.HOUSEHOLDATTRIBUTES.value: ("households", write_household_attributes),
+}
+
+
+def split_frame(head: str, tail: str) -> Tuple[str, str, Dict[str, str], str, str]:
+    """Split a rendered template frame into its prolog, root element and whitespace.
+
+    Args:
+        head: Document text before the records, ending within the root element.
+        tail: Document text after the records, ending with the root closing tag.
+
+    Returns:
+        The prolog, root tag, root attributes and the text written before and after the
+        records inside the root element.
+    """
+    end = tail.rindex("</")
+    root = tail[end + 2 : -1]
+    start = head.rindex(f"<{root}")
+    close = head.index(">", start)
+    attrib = dict(_ATTRIBUTE.findall(head[start:close]))
+    return head[:start], root, attrib, head[close + 1 :], tail[:end]
+
+
+def write_document(fh, template_name: str, frame: Tuple[str, str], data: Dict):
+    """Write a full document for ``template_name`` to the binary file handle ``fh``."""
+    key, serializer = serializer_registry[template_name]
+    prolog, root, attrib, leading, trailing = split_frame(*frame)
+
+    fh.write(prolog.encode("utf-8"))
+    # Namespace declarations are copied verbatim from the template, records are written
+    # without prefixes as they are in the template.
+    with etree.xmlfile(fh, encoding="utf-8") as xf:
+        with xf.element(root, attrib):
+            xf.write(leading)
+            serializer(xf, data.get(key, []))
+            xf.write(trailing)
@@ -0,0 +1,143 @@
+"""
+Topological simplification of physsim networks.
+
+Chains of links through degree-2 nodes, i.e. nodes which only connect two neighbors,
+are merged into single links when their attributes are compatible.  Every link of the
+simplified network maps back to the ordered links of the original network, so events of
+a simulation on the simplified network can still be joined to ``models.Link``:
+
+    .. code-block:: python
+
+        links, mapping = simplify_links(links)
+        mapping.to_csv("link-mapping.csv", index=False)
+        ...
+        expand_route([3, 7], load_link_mapping("link-mapping.csv"))
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+from loguru import logger
+
+# Links are only merged when these attributes are equal
+COMPATIBLE_ATTRIBUTES = ["highwayType", "permlanes", "modes"]
+
+MAPPING_COLUMNS = ["link_id", "original_link_id", "origid", "position"]
+
+
+def _through_nodes(links: pd.DataFrame) -> set:
+    """Nodes connecting exactly two neighbors, passed through in one or both directions."""
+    loops = links["u"] == links["v"]
+    edges = links.loc[~loops, ["u", "v"]]
+    neighbors = pd.concat(
+        [
+            edges.rename(columns={"u": "node", "v": "neighbor"}),
+            edges.rename(columns={"v": "node", "u": "neighbor"}),
+        ]
+    )
+    n_neighbors = neighbors.drop_duplicates().groupby("node").size()
+    out_degree = edges.groupby("u").size()
+    in_degree = edges.groupby("v").size()
+    degrees = pd.DataFrame({"neighbors": n_neighbors, "in": in_degree, "out": out_degree}).fillna(
+        0
+    )
+    # One-way chains have a single link in and out, two-way chains two of each
+    through = (degrees["neighbors"] == 2) & (degrees["in"] == degrees["out"])
+    through &= degrees["in"].isin([1, 2])
+    # Nodes touched by loops are never merged through
+    through &= ~degrees.index.isin(links.loc[loops, "u"])
+    return set(degrees.index[through])
+
+
+def simplify_links(links: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Merge chains of compatible links through degree-2 nodes.
+
+    Lengths of merged links are summed and their freespeed and capacity are the minimum
+    of the chain.  Other attributes are taken from the first link of the chain.
+
+    Args:
+        links: Directed links as produced by `hcme.beam.osm2physsim.link_attributes`.
+
+    Returns:
+        The simplified links with new ids, and the mapping of each simplified link to the
+        ids and OSM ids of the original links it is made of, in order.
+    """
+    links = links.reset_index(drop=True)
+    through = _through_nodes(links)
+    attributes = list(zip(*[links[c] for c in COMPATIBLE_ATTRIBUTES]))
+    u = links["u"].tolist()
+    v = links["v"].tolist()
+
+    outgoing = defaultdict(list)
+    for i, node in enumerate(u):
+        outgoing[node].append(i)
+
+    def next_link(i):
+        """The link continuing link ``i`` through its end node, if it can be merged."""
+        if v[i] not in through:
+            return None
+        for j in outgoing[v[i]]:
+            if v[j] != u[i] and attributes[j] == attributes[i]:
+                return j
+        return None
+
+    # Links which continue another link are not the start of a chain
+    continues = set()
+    for i in range(len(links)):
+        j = next_link(i)
+        if j is not None:
+            continues.add(j)
+
+    chains = []
+    visited = set()
+    # Chain starts first, then links on cycles of through nodes which have no start
+    starts = [i for i in range(len(links)) if i not in continues] + sorted(continues)
+    for i in starts:
+        if i in visited:
+            continue
+        chain = [i]
+        visited.add(i)
+        j = next_link(i)
+        while j is not None and j not in visited:
+            chain.append(j)
+            visited.add(j)
+            j = next_link(j)
+        chains.append(chain)
+
+    first = [chain[0] for chain in chains]
+    last = [chain[-1] for chain in chains]
+    position = [i for chain in chains for i in range(len(chain))]
+    link_id = [n for n, chain in enumerate(chains) for _ in chain]
+    original = [i for chain in chains for i in chain]
+
+    members = links.iloc[original].assign(link_id=link_id)
+    merged = members.groupby("link_id", sort=True).agg(
+        length=("length", "sum"), freespeed=("freespeed", "min"), capacity=("capacity", "min")
+    )
+    simplified = links.iloc[first].reset_index(drop=True)
+    simplified["v"] = links["v"].to_numpy()[last]
+    simplified[["length", "freespeed", "capacity"]] = merged.to_numpy()
+    simplified["id"] = range(len(simplified))
+
+    mapping = pd.DataFrame(
+        {
+            "link_id": link_id,
+            "original_link_id": links["id"].to_numpy()[original],
+            "origid": links["origid"].to_numpy()[original],
+            "position": position,
+        },
+        columns=MAPPING_COLUMNS,
+    )
+    logger.info("Simplified {n} links to {m}", n=len(links), m=len(simplified))
+    return simplified, mapping
+
+
+def load_link_mapping(path: str) -> Dict[int, List[int]]:
+    """Read a link mapping written from `simplify_links` into ordered original link ids."""
+    mapping = pd.read_csv(path, usecols=MAPPING_COLUMNS).sort_values(["link_id", "position"])
+    return mapping.groupby("link_id")["original_link_id"].agg(list).to_dict()
+
+
+def expand_route(route: Iterable[int], mapping: Dict[int, List[int]]) -> List[int]:
+    """Expand the links of a route on a simplified network to the original links."""
+    return [original for link_id in route for original in mapping[int(link_id)]]
@@ -0,0 +1,104 @@
+import pandas as pd
+
+from hcme.beam import csv_inputs
+
+population = [
+    {
+        "id": 1,
+        "household_id": 1,
+        "rank": 0,
+        "excluded_modes": ["car"],
+        "plan": [
+            {"type": "Home", "x": 408202.03, "y": 4524819.50, "end_time": "9:00:00"},
+            {
+                "type": "Work",
+                "x": 409050.56,
+                "y": 4525378.71,
+                "end_time": "17:30:00",
+                "mode": "walk",
+            },
+            {"type": "Home", "x": 408202.03, "y": 4524819.50, "mode": "walk"},
+        ],
+    },
+    {
+        "id": 2,
+        "household_id": 1,
+        "rank": 1,
+        "excluded_modes": [],
+        "plan": [
+            {"type": "Home", "x": 408202.03, "y": 4524819.50, "end_time": "12:00:00"},
+            {"type": "Other", "x": 408411.36, "y": 4524671.10},
+        ],
+    },
+]
+
+households = [
+    {
+        "id": 1,
+        "members": [1, 2],
+        "vehicles": ["1-0"],
+        "income": 100000,
+        "homecoordx": 408202.03,
+        "homecoordy": 4524819.50,
+    }
+]
+
+
+def test_write_plans(tmp_path):
+    output = tmp_path / "plans.csv.gz"
+    n = csv_inputs.write_csv(csv_inputs.PLANS, str(output), population, compresslevel=1)
+    plans = pd.read_csv(output)
+    assert list(plans.columns) == csv_inputs.columns[csv_inputs.PLANS]
+    assert n == len(plans) == 7
+
+    first = plans[plans["personId"] == 1]
+    assert first["planElementIndex"].tolist() == [0, 1, 2, 3, 4]
+    assert first["planElementType"].tolist() == ["activity", "leg", "activity", "leg", "activity"]
+    activities = first[first["planElementType"] == "activity"]
+    assert activities["activityEndTime"].tolist()[:2] == [9 * 3600, 17.5 * 3600]
+    assert pd.isnull(activities["activityEndTime"].iloc[-1])
+
+
+def test_plans_without_end_times():
+    plans = csv_inputs.plans_frame([{"id": 1, "plan": [{"type": "Home", "x": 1, "y": 2}]}])
+    assert plans["activityEndTime"].isna().all()
+
+    plans = csv_inputs.plans_frame([{"id": 1, "plan": None}])
+    assert plans.empty
+
+
+def test_write_persons(tmp_path):
+    output = tmp_path / "persons.csv"
+    csv_inputs.write_csv(csv_inputs.PERSONS, str(output), population)
+    persons = pd.read_csv(output)
+    assert persons["householdRank"].tolist() == [0, 1]
+    assert persons["excludedModes"].fillna("").tolist() == ["car", ""]
+    assert persons["age"].tolist() == [csv_inputs.DEFAULT_AGE] * 2
+    assert persons["isFemale"].tolist() == [csv_inputs.DEFAULT_IS_FEMALE] * 2
+
+
+def test_write_persons_attributes(tmp_path):
+    """Placeholders can be overridden and attributes in the records take precedence."""
+    output = tmp_path / "persons.csv"
+    records = [population[0], {**population[1], "age": 52, "is_female": True}]
+    csv_inputs.write_csv(csv_inputs.PERSONS, str(output), records, age=40)
+    persons = pd.read_csv(output)
+    assert persons["age"].tolist() == [40, 52]
+    assert persons["isFemale"].tolist() == [False, True]
+
+
+def test_chunks():
+    assert list(csv_inputs.chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(csv_inputs.chunks([], 2)) == []
+
+
+def test_write_households(tmp_path):
+    output = tmp_path / "households.csv"
+    csv_inputs.write_csv(csv_inputs.HOUSEHOLDS, str(output), households)
+    assert pd.read_csv(output).iloc[0].to_dict() == {
+        "householdId": 1,
+        "cars": 1,
+        "incomeValue": 100000,
+        "locationX": 408202.03,
+        "locationY": 4524819.50,
+    }
@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from hcme.beam.events.reader import PANDAS, PHYSSIM_COLUMNS, PYARROW, concat_chunks
+from hcme.beam.events.registry import PHYSSIM, Registry
+
+physsim = pd.DataFrame(
+    {
+        "person": ["1", None, "2", None, "1"],
+        "vehicle": ["1-0", "1-0", "2-0", "1-0", "1-0"],
+        "time": [100.0, 110.0, 120.0, 130.0, 140.0],
+        "link": [None, 5, None, 6, None],
+        "type": [
+            "PersonEntersVehicle",
+            "entered link",
+            "PersonEntersVehicle",
+            "entered link",
+            "PersonLeavesVehicle",
+        ],
+        "length": [None, 10.0, None, 12.0, None],
+    }
+)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    it_dir = tmp_path / "ITERS" / "it.0"
+    it_dir.mkdir(parents=True)
+    physsim.to_csv(it_dir / "0.physSimEvents.csv", index=False)
+    physsim.to_csv(it_dir / "0.events.csv", index=False)
+    return Registry(tmp_path, default_inum=0)
+
+
+@pytest.mark.parametrize("engine", [PANDAS, PYARROW])
+def test_iter_events(registry, engine):
+    chunks = list(registry.iter_events(PHYSSIM, chunksize=2, engine=engine))
+    events = pd.concat(chunks, ignore_index=True)
+    assert len(events) == len(physsim)
+    assert list(events.columns) == ["person", "vehicle", "time", "link", "type"]
+    assert all(isinstance(chunk["type"].dtype, pd.CategoricalDtype) for chunk in chunks)
+    if engine == PANDAS:
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+@pytest.mark.parametrize("engine", [PANDAS, PYARROW])
+def test_iter_events_types(registry, engine):
+    chunks = registry.iter_events(
+        PHYSSIM, types=["entered link"], columns=["vehicle", "link"], engine=engine
+    )
+    events = pd.concat(list(chunks), ignore_index=True)
+    assert events["link"].tolist() == [5.0, 6.0]
+    assert set(events["type"]) == {"entered link"}
+
+
+@pytest.mark.parametrize("engine", [PANDAS, PYARROW])
+def test_concat_chunks(registry, engine):
+    chunks = registry.iter_events(PHYSSIM, chunksize=2, engine=engine)
+    events = concat_chunks(chunks, PHYSSIM_COLUMNS)
+    assert isinstance(events["type"].dtype, pd.CategoricalDtype)
+    assert events["type"].tolist() == physsim["type"].tolist()
+
+    chunks = registry.iter_events(PHYSSIM, types=["unknown"], engine=engine)
+    events = concat_chunks(chunks, PHYSSIM_COLUMNS)
+    assert events.empty
+    assert list(events.columns) == PHYSSIM_COLUMNS
+    assert isinstance(events["type"].dtype, pd.CategoricalDtype)
+
+
+def test_read_cached(registry):
+    events = registry.read_cached(PHYSSIM, types=["entered link"], columns=["vehicle", "link"])
+    assert events["link"].tolist() == [5.0, 6.0]
+
+    cached = list(registry.cache_dir.iterdir())
+    assert len(cached) == 1
+    assert (cached[0] / "type=PersonEntersVehicle" / "hour=0").is_dir()
+
+    # Reads are served from the existing conversion until the events change
+    assert len(registry.read_cached(PHYSSIM)) == len(physsim)
+    assert list(registry.cache_dir.iterdir()) == cached
+    assert registry.read_cached(PHYSSIM, hours=[1]).empty
+
+    physsim.iloc[:2].to_csv(registry.physsim, index=False)
+    assert len(registry.read_cached(PHYSSIM)) == 2
+    assert len(list(registry.cache_dir.iterdir())) == 1
@@ -1,6 +1,20 @@
+import gzip
+import time
+
+import pytest
+from jinja2 import ChoiceLoader, DictLoader
 from lxml import etree
 
-from hcme.beam.factory import TemplateLoader, template_namespaces
+from hcme.beam import factory
+from hcme.beam.factory import (
+    JINJA,
+    LXML,
+    TemplateLoader,
+    bytecode_cache,
+    template_env,
+    template_namespaces,
+    template_registry,
+)
 
 data = {
     "population": [
@@ -131,3 +145,216 @@ def test_render_household_attributes():
         assert tree.xpath(f"//object[{i}]/attribute[@name='homecoordy']/text()")[
             0
         ] == str(household["homecoordy"])
+
+
+def test_stitch_fragments(tmp_path):
+    """Documents assembled from record fragments match a single render."""
+    for template, key in [
+        ("population", "population"),
+        ("population_attributes", "population"),
+        ("households", "households"),
+        ("household_attributes", "households"),
+    ]:
+        records = data[key]
+        fragments = []
+        for i, shard in enumerate([records[:1], records[1:]]):
+            fragment = tmp_path / f"{template}-{i}.xml"
+            TemplateLoader(template, {**data, key: shard}).write_fragment(str(fragment))
+            fragments.append(str(fragment))
+
+        output = tmp_path / f"{template}.xml"
+        TemplateLoader(template, {key: []}).stitch(str(output), fragments)
+        assert output.read_text(encoding="utf-8") == TemplateLoader(template, data).render()
+
+
+def test_lxml_backend_is_byte_identical(tmp_path):
+    """The lxml serializers write the same bytes as the templates."""
+    sparse = {
+        "population": [*data["population"], {"id": 3}, {"id": 4, "plan": [{"type": "Home"}]}],
+        "households": [
+            *data["households"],
+            {"id": 2, "vehicles": ["2-0", "2-1"], "income": 0},
+            {"id": 3, "members": [3], "income_currency": "eur", "income": 5.5},
+        ],
+    }
+    for template in ["population", "population_attributes", "households", "household_attributes"]:
+        jinja_output = tmp_path / f"{template}.jinja.xml"
+        lxml_output = tmp_path / f"{template}.lxml.xml"
+        TemplateLoader(template, sparse).write(str(jinja_output))
+        TemplateLoader(template, sparse, backend=LXML).write(str(lxml_output))
+        assert lxml_output.read_bytes() == jinja_output.read_bytes()
+
+
+def test_special_characters_are_escaped(tmp_path):
+    """Both backends escape markup in values and write the same bytes."""
+    special = {
+        "population": [
+            {
+                "id": "1&<2>",
+                "attributes": [{"name": "sex", "type": "java.lang.String", "value": "<M&F>"}],
+                "excluded_modes": ["car&bike"],
+                "rank": 0,
+                "plan": [
+                    {"type": "W&k", "x": 1, "y": 2, "end_time": "9:00:00", "mode": "<walk>"},
+                    {"type": "Home", "x": 3, "y": 4},
+                ],
+            }
+        ],
+        "households": [
+            {"id": "1&<2>", "members": ["1&<2>"], "vehicles": ["a<b"], "income": "5&6"},
+        ],
+    }
+    for template in ["population", "population_attributes", "households", "household_attributes"]:
+        jinja_output = tmp_path / f"{template}.jinja.xml"
+        lxml_output = tmp_path / f"{template}.lxml.xml"
+        TemplateLoader(template, special).write(str(jinja_output))
+        TemplateLoader(template, special, backend=LXML).write(str(lxml_output))
+        assert lxml_output.read_bytes() == jinja_output.read_bytes()
+        etree.parse(str(jinja_output))
+    assert b"W&amp;k" in (tmp_path / "population.jinja.xml").read_bytes()
+
+
+def test_write_gzip(tmp_path):
+    """Outputs ending with .gz are compressed with either backend."""
+    for backend in [JINJA, LXML]:
+        output = tmp_path / f"population.{backend}.xml.gz"
+        TemplateLoader("population", data, backend=backend, compresslevel=1).write(str(output))
+        with gzip.open(output, "rt", encoding="utf-8") as fh:
+            assert fh.read() == TemplateLoader("population", data).render()
+
+
+def test_write_incremental(tmp_path):
+    """Only changed records are rendered again and the output matches a full render."""
+    cache = str(tmp_path / "population.sqlite")
+    output = tmp_path / "population.xml"
+    population = [dict(person) for person in data["population"]]
+
+    stats = TemplateLoader("population", {"population": population}).write_incremental(
+        str(output), cache
+    )
+    assert stats == {"rendered": 2, "cached": 0, "removed": 0}
+
+    population[1] = {**population[1], "rank": 1, "plan": population[1]["plan"][:1]}
+    loader = TemplateLoader("population", {"population": population})
+    stats = loader.write_incremental(str(output), cache)
+    assert stats == {"rendered": 1, "cached": 1, "removed": 0}
+    assert output.read_text(encoding="utf-8") == loader.render()
+
+    loader = TemplateLoader("population", {"population": population[:1]})
+    stats = loader.write_incremental(str(output), cache)
+    assert stats == {"rendered": 0, "cached": 1, "removed": 1}
+    assert output.read_text(encoding="utf-8") == loader.render()
+
+
+def test_write_incremental_digests(tmp_path, monkeypatch):
+    """Records are only fetched when the hash of their source rows changed."""
+    monkeypatch.setattr(factory, "CACHE_BATCH_SIZE", 1)
+    cache = str(tmp_path / "population.sqlite")
+    output = tmp_path / "population.xml"
+    population = {person["id"]: dict(person) for person in data["population"]}
+    fetched = []
+
+    def fetch(ids):
+        fetched.append(ids)
+        return [population[person_id] for person_id in ids]
+
+    loader = TemplateLoader("population", {"population": []})
+    stats = loader.write_incremental(str(output), cache, [(1, "a"), (2, "b")], fetch)
+    assert stats == {"rendered": 2, "cached": 0, "removed": 0}
+    assert fetched == [[1, 2]]
+
+    population[2] = {**population[2], "rank": 1, "plan": population[2]["plan"][:1]}
+    stats = loader.write_incremental(str(output), cache, [(1, "a"), (2, "c")], fetch)
+    assert stats == {"rendered": 1, "cached": 1, "removed": 0}
+    assert fetched[-1] == [2]
+    expected = TemplateLoader("population", {"population": list(population.values())}).render()
+    assert output.read_text(encoding="utf-8") == expected
+
+    stats = loader.write_incremental(str(output), cache, [(2, "c")], fetch)
+    assert stats == {"rendered": 0, "cached": 1, "removed": 1}
+    assert len(fetched) == 2
+
+
+def test_write_incremental_template_changed(tmp_path, monkeypatch):
+    """Cached fragments are rendered again when the template changes."""
+    cache = str(tmp_path / "population.sqlite")
+    output = tmp_path / "population.xml"
+    population = {"population": data["population"]}
+    TemplateLoader("population", population).write_incremental(str(output), cache)
+
+    template_name = template_registry["population"]
+    source, _, _ = template_env.loader.get_source(template_env, template_name)
+    changed = source.replace('<plan selected="yes">', '<plan selected="no">')
+    loader = ChoiceLoader([DictLoader({template_name: changed}), template_env.loader])
+    monkeypatch.setattr(factory, "template_env", template_env.overlay(loader=loader))
+
+    loader = TemplateLoader("population", population)
+    stats = loader.write_incremental(str(output), cache)
+    assert stats == {"rendered": 2, "cached": 0, "removed": 0}
+    assert output.read_text(encoding="utf-8") == loader.render()
+    assert 'selected="no"' in loader.render()
+
+    # Fragments are not rendered with another backend
+    assert TemplateLoader("population", population, LXML).checksum() != loader.checksum()
+
+
+def test_bytecode_cache(tmp_path):
+    """Compiled templates are written once and reused by new environments."""
+    directory = tmp_path / "templates"
+    template_name = template_registry["population"]
+    cache = bytecode_cache(str(directory))
+    # The directory is only created when a template is compiled
+    assert not directory.exists()
+
+    env = template_env.overlay(cache_size=0, bytecode_cache=cache)
+    template = env.get_template(template_name)
+    rendered = template.render(**data)
+    (cached,) = directory.iterdir()
+    written = cached.stat().st_mtime_ns
+
+    env = template_env.overlay(cache_size=0, bytecode_cache=bytecode_cache(str(directory)))
+    source, filename, _ = env.loader.get_source(env, template_name)
+    bucket = env.bytecode_cache.get_bucket(env, template_name, filename, source)
+    assert bucket.code is not None
+    assert env.get_template(template_name).render(**data) == rendered
+    assert list(directory.iterdir()) == [cached]
+    assert cached.stat().st_mtime_ns == written
+    assert bytecode_cache("") is None
+
+
+def test_bytecode_cache_not_writable(tmp_path):
+    """Templates are compiled without caching when the directory cannot be created."""
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    env = template_env.overlay(
+        cache_size=0, bytecode_cache=bytecode_cache(str(blocker / "templates"))
+    )
+    assert env.get_template(template_registry["population"]).render(**data)
+    assert not env.bytecode_cache.writable
+
+
+def slow_records(records, delay):
+    for record in records:
+        time.sleep(delay)
+        yield record
+
+
+def test_write_summary(tmp_path):
+    """Writes report the records and bytes written and the time spent waiting on records."""
+    delay = 0.05
+    for backend in [JINJA, LXML]:
+        output = tmp_path / f"population.{backend}.xml"
+        population = slow_records(data["population"], delay)
+        summary = TemplateLoader("population", {"population": population}, backend).write(
+            str(output)
+        )
+        assert summary["records"] == len(data["population"])
+        assert summary["bytes"] == output.stat().st_size
+        assert summary["wait_seconds"] >= delay * len(data["population"])
+        assert summary["render_seconds"] < summary["wait_seconds"]
+
+
+def test_write_unbuffered(tmp_path):
+    output = tmp_path / "population.xml"
+    TemplateLoader("population", data, buffer_size=1).write(str(output))
+    assert output.read_text(encoding="utf-8") == TemplateLoader("population", data).render()
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from hcme.beam.events.index import EventIndex
+
+events = pd.DataFrame(
+    {
+        "person": ["1", "1", "2", None, "1", "2", None],
+        "vehicle": ["car-1", "car-1", "bus", "car-1", None, "bus", "bus"],
+        "time": [100.0, 101.0, 102.0, 103.0, 104.0, 105.0, 106.0],
+        "type": [
+            "actend",
+            "PersonEntersVehicle",
+            "PersonEntersVehicle",
+            "entered link",
+            "actstart",
+            "PersonLeavesVehicle",
+            "entered link",
+        ],
+        "availableAlternatives": ["CAR,WALK", None, None, None, None, None, None],
+    }
+)
+
+
+def test_event_index(tmp_path):
+    path = tmp_path / "0.events.csv"
+    events.to_csv(path, index=False)
+    index = EventIndex(path)
+
+    person = index.read(person="1")
+    assert person["time"].tolist() == [100.0, 101.0, 104.0]
+    assert person["availableAlternatives"].tolist()[0] == "CAR,WALK"
+    assert isinstance(person["type"].dtype, pd.CategoricalDtype)
+
+    trips = index.read(person="2", vehicles=["bus"])
+    assert trips["time"].tolist() == [102.0, 105.0, 106.0]
+
+    # The index is rebuilt when the events change
+    events.iloc[:2].to_csv(path, index=False)
+    assert EventIndex(path).read(person="1")["time"].tolist() == [100.0, 101.0]
+
+
+def test_event_index_many_vehicles(tmp_path):
+    """More vehicles than SQLite allows parameters in a single query are looked up."""
+    path = tmp_path / "0.events.csv"
+    events.to_csv(path, index=False)
+    # Above the limit of common SQLite builds, which is at most 250000
+    vehicles = [f"car-{i}" for i in range(250000)] + ["bus"]
+    trips = EventIndex(path).read(vehicles=vehicles)
+    assert trips["time"].tolist() == [100.0, 101.0, 102.0, 103.0, 105.0, 106.0]
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from hcme.beam.factory import TemplateLoader
+from hcme.beam.network import LinkGeometryStore
+
+nodes = [
+    {"id": 30, "x": 2.0, "y": 0.0},
+    {"id": 10, "x": 0.0, "y": 0.0},
+    {"id": 20, "x": 1.0, "y": 0.0},
+    {"id": 40, "x": 2.0, "y": 1.0},
+]
+links = [
+    {"id": 7, "u": 20, "v": 30, "length": 1, "freespeed": 1, "capacity": 1, "permlanes": 1},
+    {"id": 5, "u": 10, "v": 20, "length": 1, "freespeed": 1, "capacity": 1, "permlanes": 1},
+    {"id": 9, "u": 30, "v": 40, "length": 1, "freespeed": 1, "capacity": 1, "permlanes": 1},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    network = tmp_path / "physsim-network.xml"
+    TemplateLoader("network", {"nodes": nodes, "links": links}).write(str(network))
+    LinkGeometryStore.from_network_file(network, crs=False).save(tmp_path / "store")
+    return LinkGeometryStore.load(tmp_path / "store")
+
+
+def test_polylines(store):
+    assert isinstance(store.node_xy, np.memmap)
+    first, second = store.polylines([[5, 7, 9], [9]])
+    assert first.tolist() == [[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [2.0, 1.0]]
+    assert second.tolist() == [[2.0, 0.0], [2.0, 1.0]]
+
+    lons, lats = store.line_coordinates([second])
+    assert lons == [2.0, 2.0, None]
+    assert lats == [0.0, 1.0, None]
+
+
+def test_unknown_links(store):
+    with pytest.raises(KeyError):
+        store.polylines([[5, 6]])
+
+
+def test_unknown_nodes():
+    with pytest.raises(KeyError):
+        LinkGeometryStore.from_arrays([10, 20], [0, 1], [0, 0], [5, 7], [10, 20], [20, 30])
+
+
+def test_empty_network():
+    with pytest.raises(ValueError):
+        LinkGeometryStore.from_rows([], [])
+    with pytest.raises(ValueError):
+        LinkGeometryStore.from_rows([(10, 0.0, 0.0)], [])
+    with pytest.raises(ValueError):
+        LinkGeometryStore.from_arrays([], [], [], [], [], [])
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hcme.beam.osm2physsim import (
+    kph_to_mps,
+    link_attributes,
+    mph_to_mps,
+    parse_lanes,
+    parse_speed,
+)
+
+
+@pytest.mark.parametrize(
+    "maxspeed, expected",
+    [
+        ("35 mph", 35 * mph_to_mps),
+        ("35mph", 35 * mph_to_mps),
+        ("50", 50 * kph_to_mps),
+        ("50 km/h", 50 * kph_to_mps),
+        ("30 mph;25 mph", 30 * mph_to_mps),
+        ("signals", np.nan),
+        (None, np.nan),
+    ],
+)
+def test_parse_speed(maxspeed, expected):
+    speed = parse_speed(pd.Series([maxspeed], dtype=object)).iloc[0]
+    assert speed == pytest.approx(expected, nan_ok=True)
+
+
+@pytest.mark.parametrize(
+    "lanes, expected",
+    [("2", 2), ("2;3", 2), (" 3 ", 3), ("none", np.nan), (None, np.nan)],
+)
+def test_parse_lanes(lanes, expected):
+    assert parse_lanes(pd.Series([lanes], dtype=object)).iloc[0] == pytest.approx(
+        expected, nan_ok=True
+    )
+
+
+# (highway, maxspeed, lanes, oneway) of an edge from node 1 to node 2 and the expected
+# (u, v, freespeed, permlanes, capacity, modes) of each of its links
+edges = [
+    (
+        ("residential", "25 mph", "2", "yes"),
+        [(1, 2, 25 * mph_to_mps, 2, 1200, "car,walk")],
+    ),
+    (
+        ("residential", "40", "2;3", None),
+        [(1, 2, 40 * kph_to_mps, 1, 600, "car,walk"), (2, 1, 40 * kph_to_mps, 1, 600, "car,walk")],
+    ),
+    (
+        ("secondary", None, "4", "no"),
+        [
+            (1, 2, 35 * mph_to_mps, 2, 2000, "car,walk"),
+            (2, 1, 35 * mph_to_mps, 2, 2000, "car,walk"),
+        ],
+    ),
+    (
+        ("primary", None, None, "-1"),
+        [(2, 1, 45 * mph_to_mps, 1, 1500, "car,walk")],
+    ),
+    (
+        ("motorway", "65 mph", "3", None),
+        [(1, 2, 65 * mph_to_mps, 3, 6000, "car,walk")],
+    ),
+    (
+        ("tertiary", None, "1", None),
+        [(1, 2, 30 * mph_to_mps, 1, 600, "car,walk"), (2, 1, 30 * mph_to_mps, 1, 600, "car,walk")],
+    ),
+    (
+        ("footway", None, None, "yes"),
+        [(1, 2, 15 * mph_to_mps, 1, 300, "walk")],
+    ),
+    (
+        (None, None, None, None),
+        [(1, 2, 15 * mph_to_mps, 1, 300, "car,walk"), (2, 1, 15 * mph_to_mps, 1, 300, "car,walk")],
+    ),
+]
+
+
+@pytest.mark.parametrize("edge, expected", edges)
+def test_link_attributes(edge, expected):
+    highway, maxspeed, lanes, oneway = edge
+    links = pd.DataFrame(
+        {
+            "id": [100],
+            "u": [1],
+            "v": [2],
+            "length": [12.5],
+            "highway": [highway],
+            "maxspeed": [maxspeed],
+            "lanes": [lanes],
+            "oneway": [oneway],
+        }
+    )
+    network = link_attributes(links)
+    assert network["id"].tolist() == list(range(len(expected)))
+    assert (network["origid"] == 100).all()
+    assert (network["length"] == 12.5).all()
+    u, v, freespeed, permlanes, capacity, modes = map(list, zip(*expected))
+    assert network["u"].tolist() == u
+    assert network["v"].tolist() == v
+    assert network["freespeed"].tolist() == pytest.approx(freespeed)
+    assert network["permlanes"].tolist() == permlanes
+    assert network["capacity"].tolist() == capacity
+    assert network["modes"].tolist() == modes
+
+
+def test_link_attributes_columns():
+    links = pd.DataFrame(
+        {
+            "id": [1, 2],
+            "u": [1, 2],
+            "v": [2, 3],
+            "length": [1.0, 2.0],
+            "highway": ["residential", "motorway"],
+            "maxspeed": [None, None],
+            "lanes": [None, None],
+            "oneway": [None, None],
+        }
+    )
+    network = link_attributes(links)
+    # Reverse links follow all forward links
+    assert network[["u", "v", "origid"]].values.tolist() == [[1, 2, 1], [2, 3, 2], [2, 1, 1]]
+    assert network["highwayType"].tolist() == ["residential", "motorway", "residential"]
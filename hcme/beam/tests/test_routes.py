@@ -0,0 +1,42 @@
+import pandas as pd
+
+from hcme.beam.events.routes import reconstruct_routes
+
+events = pd.DataFrame(
+    [
+        # Person 1 drives, then takes the bus with person 2
+        ("1", "car-1", 100.0, "PersonEntersVehicle"),
+        ("1", "car-1", 200.0, "PersonLeavesVehicle"),
+        ("2", "bus", 290.0, "PersonEntersVehicle"),
+        ("1", "bus", 300.0, "PersonEntersVehicle"),
+        ("1", "bus", 400.0, "PersonLeavesVehicle"),
+        ("2", "bus", 500.0, "PersonLeavesVehicle"),
+    ],
+    columns=["person", "vehicle", "time", "type"],
+)
+
+physsim = pd.DataFrame(
+    [
+        ("car-1", 100.0, 1, "entered link"),
+        ("car-1", 150.0, 1, "left link"),
+        ("car-1", 150.0, 2, "entered link"),
+        ("car-1", 250.0, 9, "entered link"),
+        ("bus", 295.0, 3, "entered link"),
+        ("bus", 350.0, 4, "entered link"),
+        ("bus", 450.0, 5, "entered link"),
+        ("bus", 460.0, None, "vehicle leaves traffic"),
+    ],
+    columns=["vehicle", "time", "link", "type"],
+)
+
+
+def test_reconstruct_routes():
+    routes = reconstruct_routes(events, physsim)
+    person_links = routes.groupby(["person", "leg"])["link"].agg(list).to_dict()
+    assert person_links == {
+        ("1", 0): [1, 2],
+        ("1", 1): [4],
+        ("2", 0): [3, 4, 5],
+    }
+    assert routes.loc[routes["person"] == "1", "sequence"].tolist() == [0, 1, 0]
+    assert routes.loc[routes["person"] == "1", "vehicle"].tolist() == ["car-1", "car-1", "bus"]
@@ -0,0 +1,55 @@
+import pandas as pd
+
+from hcme.beam.simplify import expand_route, load_link_mapping, simplify_links
+
+
+def make_links(edges):
+    """Two-way residential links for each (u, v, length, freespeed) edge."""
+    rows = []
+    for origid, (u, v, length, freespeed) in enumerate(edges):
+        for a, b in [(u, v), (v, u)]:
+            rows.append(
+                {
+                    "u": a,
+                    "v": b,
+                    "origid": origid,
+                    "length": length,
+                    "freespeed": freespeed,
+                    "capacity": 600.0,
+                    "permlanes": 1.0,
+                    "highwayType": "residential",
+                    "modes": "car,walk",
+                }
+            )
+    links = pd.DataFrame(rows)
+    links.insert(0, "id", range(len(links)))
+    return links
+
+
+def test_simplify_chain(tmp_path):
+    # 1 - 2 - 3 - 4 is a chain through degree-2 nodes, 4 is a junction with 5, 6 and 7
+    links = make_links(
+        [(1, 2, 10.0, 10.0), (2, 3, 20.0, 8.0), (3, 4, 30.0, 12.0)]
+        + [(4, 5, 1.0, 10.0), (4, 6, 1.0, 10.0), (4, 7, 1.0, 10.0)]
+    )
+    simplified, mapping = simplify_links(links)
+
+    assert len(simplified) == 8
+    forward = simplified[(simplified["u"] == 1) & (simplified["v"] == 4)].iloc[0]
+    assert forward["length"] == 60.0
+    assert forward["freespeed"] == 8.0
+    assert set(simplified["id"]) == set(range(8))
+
+    path = tmp_path / "mapping.csv"
+    mapping.to_csv(path, index=False)
+    expanded = expand_route([forward["id"]], load_link_mapping(path))
+    assert links.set_index("id").loc[expanded, "origid"].tolist() == [0, 1, 2]
+    assert links.set_index("id").loc[expanded, "u"].tolist() == [1, 2, 3]
+
+
+def test_incompatible_links_are_kept():
+    links = make_links([(1, 2, 10.0, 10.0), (2, 3, 20.0, 8.0)])
+    links.loc[links["origid"] == 1, "permlanes"] = 2.0
+    simplified, mapping = simplify_links(links)
+    assert len(simplified) == len(links)
+    assert mapping["position"].eq(0).all()
@@ -0,0 +1,71 @@
+from click.testing import CliRunner
+
+from hcme.beam.factory import TemplateLoader
+from hcme.beam.validate import main, validate_inputs
+
+
+def plan(*end_times):
+    activities = [{"type": "Home", "x": 1.0, "y": 2.0, "end_time": t} for t in end_times]
+    return activities + [{"type": "Home", "x": 1.0, "y": 2.0}]
+
+
+data = {
+    "population": [
+        {"id": 1, "plan": plan("8:00:00", "12:30:00"), "rank": 0, "excluded_modes": []},
+        {"id": 2, "plan": plan("9:15:00"), "rank": 1, "excluded_modes": []},
+    ],
+    "households": [
+        {
+            "id": 10,
+            "members": [1, 2],
+            "vehicles": ["10-0"],
+            "income": 50000,
+            "homecoordx": 1.0,
+            "homecoordy": 2.0,
+        }
+    ],
+}
+
+
+def write_inputs(tmp_path, data):
+    paths = {}
+    for name in ["population", "households", "population_attributes", "household_attributes"]:
+        paths[name] = str(tmp_path / f"{name}.xml.gz")
+        TemplateLoader(name, data).write(paths[name])
+    return paths
+
+
+def test_valid_inputs(tmp_path):
+    reports = validate_inputs(write_inputs(tmp_path, data))
+    assert {name: report.errors for name, report in reports.items()} == {
+        "population": [],
+        "households": [],
+        "population_attributes": [],
+        "household_attributes": [],
+    }
+    assert reports["population"].records == 2
+
+
+def test_invalid_inputs(tmp_path):
+    population = [
+        {**data["population"][0], "plan": plan("12:30:00", "8:00:00")},
+        data["population"][1],
+        data["population"][1],
+    ]
+    households = [{**data["households"][0], "members": [1, 3]}]
+    paths = write_inputs(tmp_path, {"population": population, "households": households})
+    reports = validate_inputs(paths)
+    assert reports["population"].errors == [
+        "Activities of person 1 are out of order",
+        "Duplicate person id 2",
+        "Person 2 is not a member of any household",
+    ]
+    assert reports["households"].errors == ["Unknown population id 3"]
+    assert reports["population_attributes"].errors == ["Duplicate object id 2"]
+
+
+def test_no_inputs():
+    assert validate_inputs({}) == {}
+    result = CliRunner().invoke(main, [])
+    assert result.exit_code == 2
+    assert "at least one input file" in result.output
@@ -0,0 +1,272 @@
+"""
+Streaming validation of generated BEAM inputs.
+
+Files are parsed record by record with ``lxml.etree.iterparse`` and each record is
+discarded once checked, so memory is bounded by the id sets kept for uniqueness and
+referential integrity rather than by the document size.  The four inputs of a travel
+diary are validated in parallel and cross-checked afterwards:
+
+    .. code-block:: python
+
+        reports = validate_inputs({"population": "population.xml.gz", ...})
+        check_reports(reports)  # raises ValidationError
+
+Note:
+    Checks follow the expectations of the MATSim DTDs referenced by the templates but the
+    DTDs themselves are not loaded, as they are not available offline.
+"""
+import gzip
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Set
+
+import click
+from loguru import logger
+from lxml import etree
+
+from .constants import InputRegistry as INPUTS
+
+# Errors kept per file, further errors are only counted
+MAX_ERRORS = 100
+
+END_TIME = re.compile(r"^(\d+):([0-5]\d):([0-5]\d)$")
+
+
+class ValidationError(Exception):
+    pass
+
+
+@dataclass
+class Report:
+    """Outcome of validating a single file."""
+
+    input: str
+    path: str
+    records: int = 0
+    # Ids of the records in the file
+    ids: Set[str] = field(default_factory=set)
+    # Ids of records in other files referenced by this file
+    references: Set[str] = field(default_factory=set)
+    errors: List[str] = field(default_factory=list)
+    error_count: int = 0
+
+    def error(self, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def add_id(self, record_id: str, tag: str):
+        if record_id is None:
+            self.error(f"{tag} #{self.records} has no id")
+        elif record_id in self.ids:
+            self.error(f"Duplicate {tag} id {record_id}")
+        else:
+            self.ids.add(record_id)
+
+
+def _open(path: str):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _tag(element) -> str:
+    return etree.QName(element).localname
+
+
+def _seconds(end_time: str) -> int:
+    hours, minutes, seconds = map(int, END_TIME.match(end_time).groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def iter_records(path: str, tag: str):
+    """Yield each ``tag`` element of a document, clearing it after it has been used."""
+    with _open(path) as fh:
+        for _, element in etree.iterparse(
+            fh,
+            events=("end",),
+            tag=f"{{*}}{tag}",
+            load_dtd=False,
+            no_network=True,
+            resolve_entities=False,
+            huge_tree=True,
+        ):
+            yield element
+            element.clear()
+            # Drop references to processed siblings held by the root element
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def check_plan(report: Report, person_id: str, plan) -> None:
+    elements = list(plan)
+    if not elements or _tag(elements[0]) != "activity" or _tag(elements[-1]) != "activity":
+        report.error(f"Plan of person {person_id} must start and end with an activity")
+    previous_tag = None
+    previous_end = -1
+    for i, element in enumerate(elements):
+        tag = _tag(element)
+        if tag == "leg":
+            if previous_tag == "leg":
+                report.error(f"Plan of person {person_id} has consecutive legs")
+            if not element.get("mode"):
+                report.error(f"Leg of person {person_id} has no mode")
+        elif tag == "activity":
+            if not element.get("type"):
+                report.error(f"Activity of person {person_id} has no type")
+            if element.get("link") is None and (
+                element.get("x") is None or element.get("y") is None
+            ):
+                report.error(f"Activity of person {person_id} has no location")
+            end_time = element.get("end_time")
+            if end_time is None:
+                if i != len(elements) - 1:
+                    report.error(f"Activity of person {person_id} has no end_time")
+            elif not END_TIME.match(end_time):
+                report.error(f"Activity of person {person_id} has invalid end_time {end_time}")
+            else:
+                end = _seconds(end_time)
+                if end < previous_end:
+                    report.error(f"Activities of person {person_id} are out of order")
+                previous_end = end
+        previous_tag = tag
+
+
+def validate_population(report: Report) -> None:
+    for person in iter_records(report.path, "person"):
+        report.records += 1
+        person_id = person.get("id")
+        report.add_id(person_id, "person")
+        plans = [child for child in person if _tag(child) == "plan"]
+        if not plans:
+            report.error(f"Person {person_id} has no plan")
+        for plan in plans:
+            check_plan(report, person_id, plan)
+
+
+def validate_households(report: Report) -> None:
+    for household in iter_records(report.path, "household"):
+        report.records += 1
+        household_id = household.get("id")
+        report.add_id(household_id, "household")
+        for element in household.iter(etree.Element):
+            tag = _tag(element)
+            if tag in ("personId", "vehicleDefinitionId") and not element.get("refId"):
+                report.error(f"{tag} of household {household_id} has no refId")
+            elif tag == "personId":
+                person_id = element.get("refId")
+                if person_id in report.references:
+                    report.error(f"Person {person_id} is a member of several households")
+                report.references.add(person_id)
+            elif tag == "income":
+                if not element.get("currency") or not element.get("period"):
+                    report.error(f"Income of household {household_id} has no currency or period")
+
+
+def validate_object_attributes(report: Report) -> None:
+    for element in iter_records(report.path, "object"):
+        report.records += 1
+        object_id = element.get("id")
+        report.add_id(object_id, "object")
+        for attribute in element:
+            if not attribute.get("name") or not attribute.get("class"):
+                report.error(f"Attribute of object {object_id} has no name or class")
+        # Attribute files only reference ids of other files
+        report.references.add(object_id)
+    report.ids.clear()
+
+
+validator_registry: Dict[str, Callable[[Report], None]] = {
+    INPUTS.POPULATION.value: validate_population,
+    INPUTS.HOUSEHOLDS.value: validate_households,
+    INPUTS.POPULATIONATTRIBUTES.value: validate_object_attributes,
+    INPUTS.HOUSEHOLDATTRIBUTES.value: validate_object_attributes,
+}
+
+# Input -> input whose ids must contain the references of the input
+reference_registry = {
+    INPUTS.HOUSEHOLDS.value: INPUTS.POPULATION.value,
+    INPUTS.POPULATIONATTRIBUTES.value: INPUTS.POPULATION.value,
+    INPUTS.HOUSEHOLDATTRIBUTES.value: INPUTS.HOUSEHOLDS.value,
+}
+
+
+def validate_file(input_name: str, path: str) -> Report:
+    """Validate a single file of type ``input_name``, e.g. ``"population"``."""
+    report = Report(input_name, str(path))
+    try:
+        validator_registry[input_name](report)
+    except etree.XMLSyntaxError as e:
+        report.error(f"Malformed XML: {e}")
+    logger.info(
+        "Validated {records} records of {f} with {n} errors",
+        records=report.records,
+        f=path,
+        n=report.error_count,
+    )
+    return report
+
+
+def check_references(reports: Dict[str, Report]) -> None:
+    """Check that ids referenced across files exist, adding errors to the reports."""
+    for input_name, target in reference_registry.items():
+        if input_name not in reports or target not in reports:
+            continue
+        report = reports[input_name]
+        missing = report.references - reports[target].ids
+        for record_id in sorted(missing)[:MAX_ERRORS]:
+            report.error(f"Unknown {target} id {record_id}")
+        report.error_count += max(len(missing) - MAX_ERRORS, 0)
+
+    # Every person belongs to a household
+    if INPUTS.HOUSEHOLDS.value in reports and INPUTS.POPULATION.value in reports:
+        report = reports[INPUTS.POPULATION.value]
+        homeless = report.ids - reports[INPUTS.HOUSEHOLDS.value].references
+        for person_id in sorted(homeless)[:MAX_ERRORS]:
+            report.error(f"Person {person_id} is not a member of any household")
+        report.error_count += max(len(homeless) - MAX_ERRORS, 0)
+
+
+def validate_inputs(paths: Dict[str, str], max_workers: int = None) -> Dict[str, Report]:
+    """Validate BEAM inputs in parallel and check references between them.
+
+    Args:
+        paths: Path of each input, keyed by input name such as ``"households"``.
+        max_workers: Number of worker processes, one per file by default.
+    """
+    if not paths:
+        return {}
+    with ProcessPoolExecutor(max_workers or len(paths)) as pool:
+        reports = dict(zip(paths, pool.map(validate_file, paths, paths.values())))
+    check_references(reports)
+    return reports
+
+
+def check_reports(reports: Dict[str, Report]) -> None:
+    """Raise a `ValidationError` listing the errors of invalid files."""
+    invalid = [report for report in reports.values() if report.error_count]
+    if invalid:
+        lines = []
+        for report in invalid:
+            lines.append(f"{report.path}: {report.error_count} errors")
+            lines.extend(f"  {error}" for error in report.errors)
+        raise ValidationError("\n".join(lines))
+
+
+@click.command()
+@click.option("--population", type=click.Path(exists=True))
+@click.option("--households", type=click.Path(exists=True))
+@click.option("--population-attributes", type=click.Path(exists=True))
+@click.option("--household-attributes", type=click.Path(exists=True))
+def main(**paths):
+    """Validate generated BEAM input files."""
+    paths = {name: path for name, path in paths.items() if path}
+    if not paths:
+        raise click.UsageError("Pass at least one input file to validate")
+    check_reports(validate_inputs(paths))
+    click.echo("All inputs are valid")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import sqlalchemy as sa
+
+# Materialized view of household locations whose members have at least one trip.  The view
+# is created by a migration, so it is kept out of `Base.metadata` and autogenerate.
+eligible_household_locations = sa.Table(
+    "eligible_household_locations",
+    sa.MetaData(),
+    sa.Column("location_id", sa.Integer, primary_key=True),
+)
+
+
+def refresh_eligible_household_locations(session, concurrently: bool = False) -> None:
+    """Recompute the eligible household locations after trips have changed.
+
+    Args:
+        concurrently: Refresh without locking out concurrent readers of the view.
+    """
+    option = "CONCURRENTLY " if concurrently else ""
+    session.execute(sa.text(f"REFRESH MATERIALIZED VIEW {option}eligible_household_locations"))
+    session.commit()
@@ -2,6 +2,7 @@
 """
 # isort: skip_file
 
+from .demand.eligible_location import eligible_household_locations
 from .demand.scenario import DemandScenario
 from .demand.trip import Trip
 from .experiments.experiment import Experiment
@@ -0,0 +1,43 @@
+"""Materialize eligible household locations
+
+Revision ID: 0e7cc875423b
+Revises: b0126341eb03
+Create Date: 2026-10-18 09:12:41.220815
+
+"""
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0e7cc875423b"
+down_revision = "b0126341eb03"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW eligible_household_locations AS
+        SELECT DISTINCT household_locations.id AS location_id
+        FROM locations AS household_locations
+        JOIN households ON household_locations.id = households.location_id
+        JOIN persons ON households.id = persons.household_id
+        JOIN trips ON trips.person_id = persons.id
+        JOIN locations AS destinations ON trips.destination_location_id = destinations.id
+        JOIN locations AS origins ON trips.origin_location_id = origins.id
+        WITH DATA;
+        """
+    )
+    # A unique index is required to refresh the view concurrently
+    op.execute(
+        "CREATE UNIQUE INDEX ix_eligible_household_locations_location_id "
+        "ON eligible_household_locations (location_id);"
+    )
+
+
+def downgrade():
+
+    op.execute("DROP MATERIALIZED VIEW eligible_household_locations;")
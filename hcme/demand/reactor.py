@@ -3,121 +3,136 @@ Build and create BEAM input plans
 """
 import csv
 import datetime
+import itertools
+import multiprocessing as mp
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, Iterable
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterable, List, Tuple
 
 import geoalchemy2 as ga
 import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from loguru import logger
-from pyproj import Proj
+from pyproj import Proj, Transformer
+from sqlalchemy.dialects import postgresql
 from tqdm import tqdm
 
-from hcme.beam.factory import TemplateLoader
+from hcme.beam import csv_inputs, validate
+from hcme.beam.factory import JINJA, TemplateLoader, open_output
 from hcme.config import artifacts
 from hcme.db import Session, models
+from hcme.db.io import chunk
+from hcme.db.models.demand.eligible_location import refresh_eligible_household_locations
 from hcme.db.models.world.census_block_demographics import CensusBlockEconomics
+from hcme.demand.sampling import IncomeIndex, binomial
+from hcme.demand.selection import HouseholdSample, Intersection
 
 UTM10 = Proj(proj="utm", zone=10, ellps="WGS84")
 
+# Batch projection from database coordinates (EPSG:4326) to BEAM coordinates
+UTM10_TRANSFORMER = Transformer.from_crs("EPSG:4326", UTM10.crs, always_xy=True)
 
-destinations = sa.orm.aliased(models.Location)
-origins = sa.orm.aliased(models.Location)
-
-household_locations = sa.orm.aliased(models.Location)
-
-cities = [
-    "Korbel",
-    # "Mckinleyville",
-    "Redway",
-    "Garberville",
-    "Pepperwood",
-    "Redcrest",
-    "Hoopa",
-    "Willow Creek",
-    # "Cutten",
-    "Whitethorn",
-    # "Bayside",
-    # "Trinidad",
-    "Forks Of Salmon",
-    # "Manila",
-    "McCann",
-    # "Fortuna",
-    "Piercy",
-    "Waddington",
-    "Myers Flat",
-    "Port Kenyon",
-    "Phillipsville",
-    # "Arcata",
-    "Scotia",
-    "Ettersburg",
-    "Carlotta",
-    "Fields Landing",
-    "Klamath Glen",
-    "Somes Bar",
-    "Salyer",
-    "Miranda",
-    "Honeydew",
-    # "Rio Dell",
-    # "McKinleyville",
-    "Kneeland",
-    "Loleta",
-    "Aptos",
-    "Hyampom",
-    "Weott",
-    "Alderpoint",
-    "Whitlow",
-    "Stafford",
-    # "Eureka",
-    # "Blue Lake",
-    "Orleans",
-    "Shively",
-    "Pecwan",
-    "Burnt Ranch",
-    "Blocksburg",
-    "Zenia",
-    "Mad River",
-    "Klamath",
-    "Benbow",
-    "Westhaven",
-    "Orick",
-    "Bridgeville",
-    # "Ferndale",
-    # "Samoa",
-    "Hydesville",
-    "Petrolia",
-]
-
-geatm_trips = (
-    sa.select(household_locations.id)
-    .join(models.Household, household_locations.id == models.Household.location_id)
-    .join(models.Person, models.Household.id == models.Person.household_id)
-    .join(models.Trip, models.Trip.person_id == models.Person.id)
-    .join(destinations, models.Trip.destination_location_id == destinations.id)
-    .join(origins, models.Trip.origin_location_id == origins.id)
-    # .where(sa.not_(sa.and_(origins.city.in_(cities), destinations.city.in_(cities))))
-    .distinct()
+# Number of rows fetched per round trip when streaming trips from the database
+PLAN_BATCH_SIZE = 10000
+
+# Number of households drawn at once when assigning incomes and vehicles
+HOUSEHOLD_BATCH_SIZE = 5000
+
+# Output format of BEAM's CSV scenario inputs
+CSV = "csv"
+
+# Fallback income for households in census blocks without economics data
+COUNTY_MEDIAN_INCOME = 40000
+
+# Income draws use streams 0 and 1, vehicle ownership draws start after them
+VEHICLE_STREAM = 2
+
+# BEAM settings scaled with the sampled fraction of the population
+SCALING_CONFIG = "scaling.conf"
+
+
+# Households are eligible when their members have at least one trip.  Their locations are
+# materialized in the `eligible_household_locations` view once per build, see
+# `refresh_eligible_locations`.
+where_clause = sa.and_(
+    models.Location.id.in_(sa.select(models.eligible_household_locations.c.location_id))
 )
 
 
-where_clause = sa.and_(models.Location.id.in_(geatm_trips.subquery()))
+def household_where(household_filter=None):
+    """Predicate on eligible households, narrowed by an optional household filter.
 
+    See `hcme.demand.selection` for household filters.
+    """
+    if household_filter is None:
+        return where_clause
+    return sa.and_(where_clause, household_filter.where())
 
-def WKB_to_xy(wkbelement, transformer=UTM10):
-    # Build a shapely point first
-    point = ga.shape.to_shape(wkbelement)
-    x, y = transformer(point.x, point.y)
-    return x, y
+
+def refresh_eligible_locations(concurrently: bool = False) -> None:
+    """Recompute the set of household locations with trips, e.g. after trips change."""
+    session = Session()
+    logger.info("Refreshing eligible household locations")
+    refresh_eligible_household_locations(session, concurrently=concurrently)
+    session.close()
+
+
+ProjectedTrip = namedtuple(
+    "ProjectedTrip",
+    [
+        "person_id",
+        "departure",
+        "is_origin_home",
+        "is_destination_home",
+        "origin_x",
+        "origin_y",
+        "destination_x",
+        "destination_y",
+    ],
+)
+
+
+def to_utm(lon: Iterable[float], lat: Iterable[float]) -> Tuple[List[float], List[float]]:
+    """Project columns of longitudes and latitudes to BEAM coordinates in one call."""
+    x, y = UTM10_TRANSFORMER.transform(
+        np.asarray(lon, dtype=float),
+        np.asarray(lat, dtype=float),
+    )
+    return np.atleast_1d(x).tolist(), np.atleast_1d(y).tolist()
+
+
+def project_trips(partitions: Iterable[List]) -> Iterable[ProjectedTrip]:
+    """Project the origins and destinations of each partition of trip rows at once."""
+    for rows in partitions:
+        origin_x, origin_y = to_utm([r.origin_lon for r in rows], [r.origin_lat for r in rows])
+        destination_x, destination_y = to_utm(
+            [r.destination_lon for r in rows], [r.destination_lat for r in rows]
+        )
+        for row, ox, oy, dx, dy in zip(rows, origin_x, origin_y, destination_x, destination_y):
+            yield ProjectedTrip(
+                row.person_id,
+                row.departure,
+                row.is_origin_home,
+                row.is_destination_home,
+                ox,
+                oy,
+                dx,
+                dy,
+            )
 
 
 def build_plan(
-    coordinates: ga.elements.WKBElement,
+    x: float,
+    y: float,
     depart: datetime.timedelta = None,
     trip_type: str = "Other",
 ):
-    """Build a single plan for one person and convert to expected BEAM coordinates."""
-    x, y = WKB_to_xy(coordinates, transformer=UTM10)
+    """Build a single plan for one person from BEAM coordinates."""
     data = {
         "type": trip_type,
         "x": x,
@@ -129,154 +144,361 @@ def build_plan(
     return data
 
 
-def generate_person_plans(person_where=None) -> Iterable[Dict]:
-    """Go through each person and their trips"""
+def plans_from_trips(trips: Iterable[ProjectedTrip]) -> Iterable[Dict]:
+    """Group projected trips ordered by ``(person_id, trip_leg)`` into one plan per person."""
+    for person_id, legs in itertools.groupby(trips, key=lambda trip: trip.person_id):
+        plan = []
+        for trip in legs:
+            trip_type = "Home" if trip.is_origin_home else "Other"
+            plan.append(
+                build_plan(trip.origin_x, trip.origin_y, trip.departure, trip_type=trip_type)
+            )
+
+        # Include final leg as plan without end time.
+        trip_type = "Home" if trip.is_destination_home else "Other"
+        plan.append(build_plan(trip.destination_x, trip.destination_y, trip_type=trip_type))
+
+        yield {"id": person_id, "plan": plan}
+
+
+def trips_query(person_where=None, household_filter=None):
+    """All trips of eligible persons with their coordinates and home flags.
+
+    Trips are ordered by ``(person_id, trip_leg)`` so that they can be grouped into
+    plans as they are streamed from the database.
+    """
+    destinations = sa.orm.aliased(models.Location)
+    origins = sa.orm.aliased(models.Location)
+    query = (
+        sa.select(
+            models.Trip.person_id,
+            models.Trip.departure,
+            sa.func.bool(
+                models.Household.location_id == models.Trip.destination_location_id
+            ).label("is_destination_home"),
+            sa.func.bool(models.Household.location_id == models.Trip.origin_location_id).label(
+                "is_origin_home"
+            ),
+            ga.functions.ST_X(destinations.coordinates).label("destination_lon"),
+            ga.functions.ST_Y(destinations.coordinates).label("destination_lat"),
+            ga.functions.ST_X(origins.coordinates).label("origin_lon"),
+            ga.functions.ST_Y(origins.coordinates).label("origin_lat"),
+        )
+        .join(destinations, models.Trip.destination_location_id == destinations.id)
+        .join(origins, models.Trip.origin_location_id == origins.id)
+        .join(models.Person, models.Trip.person_id == models.Person.id)
+        .join(models.Household, models.Person.household_id == models.Household.id)
+        .join(models.Location, models.Household.location_id == models.Location.id)
+        .where(household_where(household_filter))
+        .order_by(models.Trip.person_id, models.Trip.trip_leg)
+    )
+    if person_where is not None:
+        query = query.where(person_where)
+    return query
+
+
+def projected_trips(session, person_where=None, household_filter=None) -> Iterable[ProjectedTrip]:
+    """Stream every eligible trip through a server-side cursor with BEAM coordinates."""
+    trips = session.execute(
+        trips_query(person_where, household_filter), execution_options={"stream_results": True}
+    ).yield_per(PLAN_BATCH_SIZE)
+    return project_trips(trips.partitions())
+
+
+def plan_digests_query(household_filter=None):
+    """Hash of the trip rows and home location each person plan is built from.
+
+    Rows are ordered by person id like `trips_query`, so that plans only need to be
+    fetched for persons whose hash changed, see `TemplateLoader.write_incremental`.
+    """
+    destinations = sa.orm.aliased(models.Location)
+    origins = sa.orm.aliased(models.Location)
+    trip = sa.func.concat_ws(
+        ",",
+        models.Trip.trip_leg,
+        models.Trip.departure,
+        models.Household.location_id,
+        models.Trip.origin_location_id,
+        models.Trip.destination_location_id,
+        sa.cast(origins.coordinates, sa.Text),
+        sa.cast(destinations.coordinates, sa.Text),
+    )
+    digest = sa.func.md5(
+        sa.func.string_agg(
+            trip, postgresql.aggregate_order_by(sa.literal_column("';'"), models.Trip.trip_leg)
+        )
+    )
+    return (
+        sa.select(models.Trip.person_id, digest.label("digest"))
+        .join(destinations, models.Trip.destination_location_id == destinations.id)
+        .join(origins, models.Trip.origin_location_id == origins.id)
+        .join(models.Person, models.Trip.person_id == models.Person.id)
+        .join(models.Household, models.Person.household_id == models.Household.id)
+        .join(models.Location, models.Household.location_id == models.Location.id)
+        .where(household_where(household_filter))
+        .group_by(models.Trip.person_id)
+        .order_by(models.Trip.person_id)
+    )
+
+
+def person_plan_digests(household_filter=None) -> Iterable[Tuple[int, str]]:
+    """Stream ``(person id, hash)`` of every person plan, see `plan_digests_query`."""
+    session = Session()
+    digests = session.execute(
+        plan_digests_query(household_filter), execution_options={"stream_results": True}
+    )
+    for row in digests.yield_per(PLAN_BATCH_SIZE):
+        yield row.person_id, row.digest
+    session.close()
+
+
+def fetch_person_plans(person_ids: List[int], household_filter=None) -> Iterable[Dict]:
+    """Plans of the given persons, fetched in batches and ordered by person id."""
+    for batch in chunk(sorted(person_ids), PLAN_BATCH_SIZE):
+        yield from generate_person_plans(
+            person_where=models.Trip.person_id.in_(list(batch)),
+            household_filter=household_filter,
+        )
+
+
+def generate_person_plans(
+    person_where=None, bulk: bool = True, household_filter=None
+) -> Iterable[Dict]:
+    """Go through each person and their trips
+
+    Args:
+        person_where: Optional filter applied to the selected persons.
+        bulk: Fetch every trip in a single server-side cursor query and group them into
+            plans as they stream in, instead of issuing one trip query per person.
+        household_filter: Only include members of the selected households.
+    """
 
     session = Session()
+
+    if bulk:
+        trips = projected_trips(session, person_where, household_filter)
+        yield from tqdm(plans_from_trips(trips))
+        return
+
     query = (
         sa.select(models.Person)
         .join(models.Household, models.Person.household_id == models.Household.id)
         .join(models.Location, models.Household.location_id == models.Location.id)
-        .where(where_clause)
+        .where(household_where(household_filter))
     )
-    if person_where:
+    if person_where is not None:
         query = query.where(person_where)
     for result in tqdm(session.execute(query)):
         person = result.Person
         # Get person trips
-        destinations = sa.orm.aliased(models.Location)
-        origins = sa.orm.aliased(models.Location)
-        query = (
-            sa.select(
-                models.Trip,
-                sa.func.bool(
-                    models.Household.location_id == models.Trip.destination_location_id
-                ).label("is_destination_home"),
-                sa.func.bool(
-                    models.Household.location_id == models.Trip.origin_location_id
-                ).label("is_origin_home"),
-                destinations.coordinates.label("destination"),
-                origins.coordinates.label("origin"),
-            )
-            .join(destinations, models.Trip.destination_location_id == destinations.id)
-            .join(origins, models.Trip.origin_location_id == origins.id)
-            .join(models.Person, models.Trip.person_id == models.Person.id)
-            .join(models.Household, models.Person.household_id == models.Household.id)
-            .where(models.Trip.person_id == person.id)
-            .order_by(models.Trip.trip_leg)
-        )
-
-        trips = session.execute(query)
+        query = trips_query(models.Trip.person_id == person.id)
+        trips = session.execute(query).all()
+        yield from plans_from_trips(project_trips([trips]))
 
-        plan = []
 
-        for trip in trips:
-            trip_type = "Home" if trip.is_origin_home else "Other"
-            plan.append(
-                build_plan(trip.origin, trip.Trip.departure, trip_type=trip_type)
-            )
-
-        # Include final leg as plan without end time.
-        trip_type = "Home" if trip.is_destination_home else "Other"
-        plan.append(build_plan(trip.destination, trip_type=trip_type))
-
-        yield {"id": person.id, "plan": plan}
+def load_income_index(session) -> IncomeIndex:
+    """Load the census block economics table once into an in-memory income index."""
+    economics = pd.read_sql_query(
+        sa.select(
+            CensusBlockEconomics.block_id,
+            CensusBlockEconomics.pct,
+            CensusBlockEconomics.household_income_lower_bound,
+            CensusBlockEconomics.household_income_upper_bound,
+        ),
+        con=session.bind,
+    )
+    return IncomeIndex.from_frame(economics)
 
 
-def generate_households(
-    pct_vehicle_ownership: float, vehicle_type="beamVilleCar", scenario_name: str = ""
-) -> Iterable[Dict]:
+def household_records(household_filter=None) -> Iterable[Dict]:
+    """Households with their members and incomes, ordered by id and without vehicles."""
     session = Session()
 
+    # Members are aggregated in id order so that households need no further queries
     q = (
         sa.select(
-            models.Household,
+            models.Household.id,
             models.Location.census_block_geoid.label("census_block_id"),
+            postgresql.array_agg(
+                postgresql.aggregate_order_by(models.Person.id, models.Person.id)
+            ).label("members"),
         )
         .join(
             models.Location,
             models.Location.id == models.Household.location_id,
         )
-        .where(where_clause)
+        .join(models.Person, models.Person.household_id == models.Household.id)
+        .where(household_where(household_filter))
+        .group_by(models.Household.id, models.Location.census_block_geoid)
         .order_by(models.Household.id)
     )
 
-    county_median_income = 40000
+    income_index = load_income_index(session)
 
-    # Write vehicles file
-    fh = scenario_path(artifacts.vehicles, scenario_name).open("w")
+    households = session.execute(q, execution_options={"stream_results": True})
+    for rows in tqdm(households.yield_per(HOUSEHOLD_BATCH_SIZE).partitions()):
+        # Draws are keyed by household id so that every batch is reproducible
+        incomes = income_index.draw(
+            [row.census_block_id for row in rows],
+            [row.id for row in rows],
+            default=COUNTY_MEDIAN_INCOME,
+        )
+        for row, income in zip(rows, incomes.tolist()):
+            yield {
+                "id": row.id,
+                "members": list(row.members),
+                "income": income,
+            }
 
-    vehicles_recorder = csv.writer(fh, delimiter=",")
-    vehicles_recorder.writerow(["vehicleId", "vehicleTypeId", "householdId"])
 
-    for household, census_block_id in tqdm(session.execute(q)):
-        economics = pd.read_sql_query(
-            sa.select(models.CensusBlockEconomics).where(
-                models.CensusBlockEconomics.block_id == census_block_id
-            ),
-            con=session.bind.engine,
-        )
-        # Fix the number of vehicles per household
-        np.random.seed(household.id)
-        num_vehicles = np.random.binomial(
-            len(household.members),
+def assign_vehicles(
+    households: Iterable[Dict], pct_vehicle_ownership: float, vehicle_type: str, recorder
+) -> Iterable[Dict]:
+    """Draw vehicles for each household and record them with a csv ``recorder``."""
+    for batch in chunk(households, HOUSEHOLD_BATCH_SIZE):
+        batch = list(batch)
+        num_vehicles = binomial(
+            [household["id"] for household in batch],
+            [len(household["members"]) for household in batch],
             pct_vehicle_ownership,
+            stream=VEHICLE_STREAM,
         )
+        for household, n in zip(batch, num_vehicles.tolist()):
+            vehicles = [f"{household['id']}-{i}" for i in range(n)]
+            for vehicle in vehicles:
+                recorder.writerow([vehicle, vehicle_type, household["id"]])
+            yield {**household, "vehicles": vehicles}
+
 
-        if not economics["pct"].sum():
-            income_bracket = county_median_income
+def generate_households(
+    pct_vehicle_ownership: float,
+    vehicle_type="beamVilleCar",
+    scenario_name: str = "",
+    compresslevel: int = None,
+    households: Iterable[Dict] = None,
+    store=None,
+    household_filter=None,
+) -> Iterable[Dict]:
+    """Households with vehicles, writing the vehicles file of the scenario alongside.
+
+    Args:
+        households: Pre-fetched ``household_records`` to reuse across scenarios.  Read from
+            the plans store or the database when not given.
+        store: ``hcme.demand.store.PlansStore`` to read households from.
+        household_filter: Only include the selected households when reading them from
+            the database.
+    """
+    if households is None:
+        if store is not None:
+            households = store.households()
         else:
-            income_bracket = economics.sample(
-                1, weights="pct", random_state=household.id
-            ).iloc[0]
-            np.random.seed(household.id)
-            income = np.random.uniform(
-                income_bracket["household_income_lower_bound"],
-                income_bracket["household_income_upper_bound"],
-            )
+            households = household_records(household_filter)
 
-        data = {
-            "id": household.id,
-            "members": [m.id for m in household.members],
-            "vehicles": [f"{household.id}-{i}" for i in range(num_vehicles)],
-            "income": income,
-        }
-        for vehicle in data["vehicles"]:
-            vehicles_recorder.writerow([vehicle, vehicle_type, household.id])
-        yield data
+    # Write vehicles file
+    fh = open_output(
+        compressed_path(scenario_path(artifacts.vehicles, scenario_name), compresslevel),
+        "w",
+        compresslevel,
+    )
+
+    vehicles_recorder = csv.writer(fh, delimiter=",")
+    vehicles_recorder.writerow(["vehicleId", "vehicleTypeId", "householdId"])
+
+    yield from assign_vehicles(households, pct_vehicle_ownership, vehicle_type, vehicles_recorder)
 
     fh.close()
 
 
-def generate_household_attributes():
+def merge_household_attributes(
+    households: Iterable[Dict], attributes: Iterable[Dict]
+) -> Iterable[Dict]:
+    """Join household attributes onto households, both ordered by household id."""
+    attributes = iter(attributes)
+    for household in households:
+        for attribute in attributes:
+            if attribute["id"] == household["id"]:
+                break
+        else:
+            raise ValueError(f"No attributes for household {household['id']}")
+        yield {**attribute, **household}
+
+
+def generate_household_locations(
+    pct_vehicle_ownership: float,
+    vehicle_type="beamVilleCar",
+    scenario_name: str = "",
+    compresslevel: int = None,
+    store=None,
+    household_filter=None,
+) -> Iterable[Dict]:
+    """Households with vehicles and home coordinates, as needed for the CSV format."""
+    households = generate_households(
+        pct_vehicle_ownership,
+        vehicle_type=vehicle_type,
+        scenario_name=scenario_name,
+        compresslevel=compresslevel,
+        store=store,
+        household_filter=household_filter,
+    )
+    if store is not None:
+        attributes = store.household_attributes()
+    else:
+        attributes = generate_household_attributes(household_filter)
+    return merge_household_attributes(households, attributes)
+
+
+def generate_household_attributes(household_filter=None):
 
     session = Session()
     query = (
-        sa.select(models.Household, models.Location.coordinates.label("coordinates"))
+        sa.select(
+            models.Household.id,
+            ga.functions.ST_X(models.Location.coordinates).label("lon"),
+            ga.functions.ST_Y(models.Location.coordinates).label("lat"),
+        )
         .join(models.Location, models.Location.id == models.Household.location_id)
-        .where(where_clause)
+        .where(household_where(household_filter))
+        .order_by(models.Household.id)
     )
 
-    for (household, coordinates) in tqdm(session.execute(query)):
-        x, y = WKB_to_xy(coordinates, transformer=UTM10)
-        yield {"id": household.id, "homecoordx": x, "homecoordy": y}
+    households = session.execute(query, execution_options={"stream_results": True})
+    for rows in tqdm(households.yield_per(PLAN_BATCH_SIZE).partitions()):
+        xs, ys = to_utm([r.lon for r in rows], [r.lat for r in rows])
+        for row, x, y in zip(rows, xs, ys):
+            yield {"id": row.id, "homecoordx": x, "homecoordy": y}
 
 
-def generate_person_attributes():
+def generate_person_attributes(household_filter=None):
 
     session = Session()
+    # Rank household members by id
     query = (
-        sa.select(models.Household)
+        sa.select(
+            models.Person.id,
+            models.Person.household_id,
+            (
+                sa.func.row_number().over(
+                    partition_by=models.Person.household_id, order_by=models.Person.id
+                )
+                - 1
+            ).label("rank"),
+        )
+        .join(models.Household, models.Person.household_id == models.Household.id)
         .join(models.Location, models.Household.location_id == models.Location.id)
-        .where(where_clause)
+        .where(household_where(household_filter))
+        .order_by(models.Person.household_id, models.Person.id)
     )
-    for (household,) in tqdm(session.execute(query)):
-        # Order household members by id
-        for i, person in enumerate(sorted(household.members, key=lambda m: m.id)):
-            # TODO: Include a way of assigning excluded modes something like
-            # np.random.seed(household.id)
-            # np.random.choice(["walk", "bike", "drive"], p=[0.2, 0.2, 0.6])
-            yield {"id": person.id, "rank": i, "excluded_modes": []}
+    persons = session.execute(query, execution_options={"stream_results": True})
+    for person in tqdm(persons.yield_per(HOUSEHOLD_BATCH_SIZE)):
+        # TODO: Include a way of assigning excluded modes something like
+        # np.random.seed(household.id)
+        # np.random.choice(["walk", "bike", "drive"], p=[0.2, 0.2, 0.6])
+        yield {
+            "id": person.id,
+            "household_id": person.household_id,
+            "rank": person.rank,
+            "excluded_modes": [],
+        }
 
 
 def scenario_path(path: Path, scenario_name: str) -> Path:
@@ -286,34 +508,441 @@ def scenario_path(path: Path, scenario_name: str) -> Path:
     return str(new_dir)
 
 
-def build_travel_diary(pct_vehicle_ownership: float, scenario_name: str) -> None:
-    """Build a travel diary"""
+def compressed_path(path: str, compresslevel: int = None) -> str:
+    """Append a ``.gz`` suffix to outputs which should be gzip compressed."""
+    if compresslevel is None or str(path).endswith(".gz"):
+        return str(path)
+    return f"{path}.gz"
+
+
+# Jobs with a ``cache`` re-render changed records only.  Jobs with ``digests`` and
+# ``fetch`` also only fetch changed records, see `TemplateLoader.write_incremental`.
+RenderJob = namedtuple(
+    "RenderJob",
+    [
+        "template",
+        "key",
+        "generate",
+        "output",
+        "shards",
+        "backend",
+        "compresslevel",
+        "cache",
+        "digests",
+        "fetch",
+    ],
+    defaults=[None, JINJA, None, None, None, None],
+)
 
-    # Keys here are used by the template renderers
-    data = {
-        "population": generate_person_plans(),
-        "households": generate_households(
-            pct_vehicle_ownership, scenario_name=scenario_name
-        ),
-    }
 
-    attributes = {
-        "population": generate_person_attributes(),
-        "households": generate_household_attributes(),
-    }
+def id_ranges(first: int, last: int, shards: int) -> List[Tuple[int, int]]:
+    """Split ids from ``first`` to ``last`` into at most ``shards`` half-open ranges.
 
-    TemplateLoader("population", data).write(
-        scenario_path(artifacts.population, scenario_name)
-    )
+    No ranges are returned when there are no ids, i.e. ``first`` and ``last`` are None.
+    """
+    if first is None or last is None:
+        return []
+    bounds = np.unique(np.linspace(first, last + 1, shards + 1).astype(int))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
 
-    TemplateLoader("households", data).write(
-        scenario_path(artifacts.households, scenario_name)
-    )
 
-    TemplateLoader("population_attributes", attributes).write(
-        scenario_path(artifacts.population_attributes, scenario_name)
+def person_id_ranges(shards: int) -> List[Tuple[int, int]]:
+    """Split the person id space into ``shards`` contiguous half-open ranges."""
+    session = Session()
+    first, last = session.execute(
+        sa.select(sa.func.min(models.Person.id), sa.func.max(models.Person.id))
+    ).one()
+    session.close()
+    return id_ranges(first, last, shards)
+
+
+def render_shard(job: RenderJob, bounds: Tuple[int, int], output: str) -> str:
+    """Render the records of persons with ids in ``bounds`` to a fragment file."""
+    lower, upper = bounds
+    records = job.generate(
+        person_where=sa.and_(models.Person.id >= lower, models.Person.id < upper)
     )
+    TemplateLoader(job.template, {job.key: records}).write_fragment(output)
+    return output
+
+
+def write_sharded(job: RenderJob) -> None:
+    """Render a job across worker processes by person id range and stitch the fragments.
+
+    The job's generator must accept a ``person_where`` filter and yield persons in id
+    order, as ``generate_person_plans`` does.  Fragments are rendered with Jinja only.
+    """
+    if job.backend != JINJA:
+        raise ValueError(f"Sharded jobs are rendered with {JINJA}, not {job.backend}")
+    ranges = person_id_ranges(job.shards)
+    output = Path(job.output)
+    with TemporaryDirectory(dir=output.parent) as tmp:
+        fragments = [str(Path(tmp) / f"{output.name}.{i}") for i in range(len(ranges))]
+        if ranges:
+            # Spawn workers so that none of them inherits the parent's connection pool
+            with ProcessPoolExecutor(len(ranges), mp_context=mp.get_context("spawn")) as pool:
+                fragments = list(pool.map(partial(render_shard, job), ranges, fragments))
+        loader = TemplateLoader(job.template, {job.key: []}, compresslevel=job.compresslevel)
+        loader.stitch(job.output, fragments)
+
+
+def travel_diary_jobs(
+    pct_vehicle_ownership: float,
+    scenario_name: str,
+    population_shards: int = None,
+    backends: Dict[str, str] = None,
+    compresslevel: int = None,
+    store=None,
+    cache_dir: str = None,
+    household_filter=None,
+) -> List[RenderJob]:
+    """Describe the BEAM inputs of a travel diary as independent render jobs.
+
+    Generators are only created when a job runs, so each job owns its own session.  Jobs
+    read from ``store`` instead of the database when a plans store is given.  Jinja jobs
+    keep their rendered records in ``cache_dir`` when given and only re-render records
+    which changed since the last build.
+    """
+    backends = backends or {}
+    if cache_dir and population_shards:
+        logger.warning("Population shards are not supported with a fragment cache")
+        population_shards = None
+    if store is not None and household_filter is not None:
+        raise ValueError("Household filters are not supported when reading a plans store")
+    if store is not None:
+        if population_shards:
+            logger.warning("Population shards are not supported when reading a plans store")
+        population_shards = None
+        person_plans = store.person_plans
+        person_attributes = store.person_attributes
+        household_attributes = store.household_attributes
+    else:
+        person_plans = partial(generate_person_plans, household_filter=household_filter)
+        person_attributes = partial(generate_person_attributes, household_filter)
+        household_attributes = partial(generate_household_attributes, household_filter)
+    if population_shards and backends.get("population", JINJA) != JINJA:
+        raise ValueError(f"Population shards are only supported with the {JINJA} backend")
 
-    TemplateLoader("household_attributes", attributes).write(
-        scenario_path(artifacts.household_attributes, scenario_name)
-    )
+    # Keys here are used by the template renderers
+    jobs = [
+        RenderJob(
+            "population",
+            "population",
+            person_plans,
+            scenario_path(artifacts.population, scenario_name),
+            population_shards,
+        ),
+        RenderJob(
+            "households",
+            "households",
+            partial(
+                generate_households,
+                pct_vehicle_ownership,
+                scenario_name=scenario_name,
+                compresslevel=compresslevel,
+                store=store,
+                household_filter=household_filter,
+            ),
+            scenario_path(artifacts.households, scenario_name),
+        ),
+        RenderJob(
+            "population_attributes",
+            "population",
+            person_attributes,
+            scenario_path(artifacts.population_attributes, scenario_name),
+        ),
+        RenderJob(
+            "household_attributes",
+            "households",
+            household_attributes,
+            scenario_path(artifacts.household_attributes, scenario_name),
+        ),
+    ]
+    jobs = [
+        job._replace(
+            output=compressed_path(job.output, compresslevel),
+            backend=backends.get(job.template, JINJA),
+            compresslevel=compresslevel,
+        )
+        for job in jobs
+    ]
+    if cache_dir:
+        jobs = [
+            job._replace(cache=str(Path(cache_dir) / scenario_name / f"{job.template}.sqlite"))
+            if job.backend == JINJA
+            else job
+            for job in jobs
+        ]
+        # Plans are only fetched for persons whose trips changed
+        jobs = [
+            job._replace(
+                digests=partial(person_plan_digests, household_filter),
+                fetch=partial(fetch_person_plans, household_filter=household_filter),
+            )
+            if job.template == "population" and job.cache and store is None
+            else job
+            for job in jobs
+        ]
+    return jobs
+
+
+def csv_jobs(
+    pct_vehicle_ownership: float,
+    scenario_name: str,
+    compresslevel: int = None,
+    store=None,
+    household_filter=None,
+) -> List[RenderJob]:
+    """Describe the BEAM CSV scenario inputs of a travel diary as render jobs.
+
+    The CSV files are written to the scenario directory of the population artifact.
+    """
+    directory = Path(scenario_path(artifacts.population, scenario_name)).parent
+    if store is not None and household_filter is not None:
+        raise ValueError("Household filters are not supported when reading a plans store")
+    if store is not None:
+        person_plans = store.person_plans
+        person_attributes = store.person_attributes
+    else:
+        person_plans = partial(generate_person_plans, household_filter=household_filter)
+        person_attributes = partial(generate_person_attributes, household_filter)
+
+    jobs = [
+        RenderJob(csv_inputs.PLANS, csv_inputs.PLANS, person_plans, None),
+        RenderJob(csv_inputs.PERSONS, csv_inputs.PERSONS, person_attributes, None),
+        RenderJob(
+            csv_inputs.HOUSEHOLDS,
+            csv_inputs.HOUSEHOLDS,
+            partial(
+                generate_household_locations,
+                pct_vehicle_ownership,
+                scenario_name=scenario_name,
+                compresslevel=compresslevel,
+                store=store,
+                household_filter=household_filter,
+            ),
+            None,
+        ),
+    ]
+    return [
+        job._replace(
+            output=compressed_path(directory / f"{job.template}.csv", compresslevel),
+            backend=CSV,
+            compresslevel=compresslevel,
+        )
+        for job in jobs
+    ]
+
+
+def run_render_job(job: RenderJob) -> Tuple[str, float]:
+    """Render a single job and return its template name with the elapsed seconds."""
+    start = time.perf_counter()
+    if job.backend == CSV:
+        csv_inputs.write_csv(job.template, job.output, job.generate(), job.compresslevel)
+    elif job.shards:
+        write_sharded(job)
+    elif job.digests:
+        loader = TemplateLoader(job.template, {job.key: []}, job.backend, job.compresslevel)
+        loader.write_incremental(job.output, job.cache, job.digests(), job.fetch)
+    else:
+        loader = TemplateLoader(
+            job.template, {job.key: job.generate()}, job.backend, job.compresslevel
+        )
+        if job.cache:
+            loader.write_incremental(job.output, job.cache)
+        else:
+            loader.write(job.output)
+    elapsed = time.perf_counter() - start
+    logger.info("Rendered {template} in {elapsed:.1f}s", template=job.template, elapsed=elapsed)
+    return job.template, elapsed
+
+
+def build_travel_diary(
+    pct_vehicle_ownership: float,
+    scenario_name: str,
+    max_workers: int = None,
+    processes: bool = False,
+    population_shards: int = None,
+    backends: Dict[str, str] = None,
+    compresslevel: int = None,
+    refresh: bool = True,
+    store=None,
+    output_format: str = "xml",
+    cache_dir: str = None,
+    sample_fraction: float = None,
+    sample_seed: int = 0,
+    sample_strata: str = "taz",
+    region=None,
+    validate_inputs: bool = False,
+) -> Dict[str, float]:
+    """Build a travel diary
+
+    Args:
+        pct_vehicle_ownership: Probability of each household member owning a vehicle.
+        scenario_name: Name of the scenario directory to write inputs to.
+        max_workers: Render the input files concurrently with this many workers.  Files
+            are rendered one after another when not set.
+        processes: Use a process pool instead of a thread pool for concurrent rendering.
+        population_shards: Split the population file by person id across this many worker
+            processes.
+        backends: Serializer backend for each input, e.g. ``{"population": "lxml"}``.
+            Inputs default to the Jinja templates.
+        compresslevel: Write every input, including the vehicles file, as ``.gz`` with this
+            gzip compression level.
+        refresh: Recompute the eligible household locations before rendering.
+        store: ``hcme.demand.store.PlansStore`` snapshot to render from instead of the
+            database.
+        output_format: ``"xml"`` for the MATSim XML inputs or ``"csv"`` for BEAM's CSV
+            scenario format (plans.csv, persons.csv and households.csv).
+        cache_dir: Directory of rendered record fragments from previous builds.  Only
+            persons and households whose trips, home location or attributes changed are
+            rendered again and the XML inputs are reassembled from cached fragments.
+            Plans are only fetched for persons whose trips or home location changed.
+        sample_fraction: Only build inputs for this fraction of households, sampled per
+            TAZ or census block with ``sample_seed``.  BEAM capacity settings scaled to
+            the sample are written to ``scaling.conf`` in the scenario directory.
+        sample_seed: Seed of the household sample.
+        sample_strata: ``"taz"`` or ``"census_block"``.
+        region: ``hcme.demand.selection.Region`` to build a regional sub-model for.
+        validate_inputs: Validate the generated XML inputs with `hcme.beam.validate`,
+            raising ``ValidationError`` when they are invalid.
+
+    Returns:
+        Seconds spent rendering each input file.
+    """
+    # Checked before anything is written to the scenario directory
+    if store is not None and (region is not None or sample_fraction is not None):
+        raise ValueError("Household filters are not supported when reading a plans store")
+    if refresh and store is None:
+        refresh_eligible_locations()
+
+    household_filters = []
+    if region is not None:
+        household_filters.append(region)
+    if sample_fraction is not None:
+        household_filters.append(HouseholdSample(sample_fraction, sample_seed, sample_strata))
+        write_scaling_config(sample_fraction, scenario_name)
+    household_filter = Intersection(tuple(household_filters)) if household_filters else None
+
+    if output_format == CSV:
+        jobs = csv_jobs(
+            pct_vehicle_ownership, scenario_name, compresslevel, store, household_filter
+        )
+    else:
+        jobs = travel_diary_jobs(
+            pct_vehicle_ownership,
+            scenario_name,
+            population_shards,
+            backends,
+            compresslevel,
+            store,
+            cache_dir,
+            household_filter,
+        )
+    timings = run_render_jobs(jobs, max_workers, processes)
+
+    if validate_inputs and output_format != CSV:
+        reports = validate.validate_inputs({job.template: job.output for job in jobs})
+        validate.check_reports(reports)
+    return timings
+
+
+def write_scaling_config(sample_fraction: float, scenario_name: str) -> str:
+    """Write BEAM settings for a population sample to include in the scenario config.
+
+    The sample is already drawn, so BEAM simulates every agent while road and transit
+    capacities are scaled down to the sampled fraction of demand.
+    """
+    output = Path(scenario_path(artifacts.population, scenario_name)).parent / SCALING_CONFIG
+    settings = {
+        "beam.agentsim.agentSampleSizeAsFractionOfPopulation": 1.0,
+        "beam.physsim.flowCapacityFactor": sample_fraction,
+        "beam.physsim.storageCapacityFactor": sample_fraction,
+        "beam.agentsim.tuning.transitCapacity": sample_fraction,
+    }
+    with open(output, "w") as fh:
+        for key, value in settings.items():
+            fh.write(f"{key} = {value}\n")
+    logger.info("Wrote BEAM scaling settings to {f}", f=output)
+    return str(output)
+
+
+def run_render_jobs(
+    jobs: List[RenderJob], max_workers: int = None, processes: bool = False
+) -> Dict[str, float]:
+    """Run render jobs one after another or in a pool and log the time spent on each."""
+    if max_workers:
+        if processes:
+            # Spawn workers so that none of them inherits the parent's connection pool
+            pool = ProcessPoolExecutor(max_workers, mp_context=mp.get_context("spawn"))
+        else:
+            pool = ThreadPoolExecutor(max_workers)
+        with pool:
+            timings = dict(pool.map(run_render_job, jobs))
+    else:
+        timings = dict(map(run_render_job, jobs))
+
+    for template, elapsed in sorted(timings.items(), key=lambda t: t[1], reverse=True):
+        logger.info("{template}: {elapsed:.1f}s", template=template, elapsed=elapsed)
+    return timings
+
+
+def ownership_scenario_name(scenario_name: str, pct_vehicle_ownership: float) -> str:
+    """Name of the sub-scenario holding households and vehicles of one ownership level."""
+    return f"{scenario_name}/vehicle-ownership-{pct_vehicle_ownership:g}"
+
+
+def sweep_vehicle_ownership(
+    levels: Iterable[float],
+    scenario_name: str,
+    vehicle_type: str = "beamVilleCar",
+    max_workers: int = None,
+    processes: bool = False,
+    backends: Dict[str, str] = None,
+    compresslevel: int = None,
+    refresh: bool = True,
+    store=None,
+) -> Dict[str, float]:
+    """Build travel diaries for several vehicle ownership levels in a single database pass.
+
+    Population and attribute files do not depend on vehicle ownership and are written once
+    under ``scenario_name``.  Households are read once and only the households and vehicles
+    files are written for each level, under ``ownership_scenario_name``.
+
+    Returns:
+        Seconds spent rendering each input file.
+    """
+    if refresh and store is None:
+        refresh_eligible_locations()
+
+    backends = backends or {}
+    shared = [
+        job
+        for job in travel_diary_jobs(
+            None, scenario_name, backends=backends, compresslevel=compresslevel, store=store
+        )
+        if job.template != "households"
+    ]
+    timings = run_render_jobs(shared, max_workers, processes)
+
+    households = list(store.households() if store is not None else household_records())
+    for pct_vehicle_ownership in levels:
+        name = ownership_scenario_name(scenario_name, pct_vehicle_ownership)
+        job = RenderJob(
+            "households",
+            "households",
+            partial(
+                generate_households,
+                pct_vehicle_ownership,
+                vehicle_type=vehicle_type,
+                scenario_name=name,
+                compresslevel=compresslevel,
+                households=households,
+            ),
+            compressed_path(scenario_path(artifacts.households, name), compresslevel),
+            backend=backends.get("households", JINJA),
+            compresslevel=compresslevel,
+        )
+        _, elapsed = run_render_job(job)
+        timings[name] = elapsed
+    return timings
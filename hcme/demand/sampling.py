@@ -0,0 +1,116 @@
+"""
+Deterministic, vectorized draws used to synthesize household characteristics.
+
+Draws are derived from a hash of each record's id rather than a global random state, so
+a household always receives the same values no matter which batch it is processed in.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        z = x + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX1
+        z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+def hashed_uniform(keys, stream: int = 0) -> np.ndarray:
+    """Uniform draws in [0, 1) which only depend on each key and the stream number.
+
+    Args:
+        keys: Integer ids, e.g. household ids.  Any shape is supported.
+        stream: Independent sequence of draws for the same keys.
+    """
+    keys = np.asarray(keys).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        z = _splitmix64(_splitmix64(keys) ^ _splitmix64(np.uint64(stream) + _GOLDEN))
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def binomial(keys, n, p: float, stream: int = 0) -> np.ndarray:
+    """Draw ``Binomial(n, p)`` for each key as the count of ``n`` Bernoulli trials.
+
+    Each trial ``i`` of a key uses its own stream, so raising ``p`` never removes a success.
+    """
+    keys = np.asarray(keys)
+    n = np.asarray(n, dtype=int)
+    width = int(n.max(initial=0))
+    if not width:
+        return np.zeros(len(keys), dtype=int)
+    trials = np.stack(
+        [hashed_uniform(keys, stream=stream + i) for i in range(width)],
+        axis=1,
+    )
+    successes = (trials < p) & (np.arange(width) < n[:, None])
+    return successes.sum(axis=1)
+
+
+@dataclass
+class IncomeIndex:
+    """Per-census-block income distribution held as flat arrays.
+
+    The cumulative weights of block ``i`` are offset by ``i`` so that a single
+    ``searchsorted`` call can pick brackets for households in any number of blocks.
+    """
+
+    block_ids: np.ndarray
+    cumulative: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    @classmethod
+    def from_frame(cls, economics: pd.DataFrame) -> "IncomeIndex":
+        """Build the index from rows of ``CensusBlockEconomics``."""
+        economics = economics.sort_values(
+            ["block_id", "household_income_lower_bound", "household_income_upper_bound"]
+        )
+        totals = economics.groupby("block_id")["pct"].transform("sum")
+        # Blocks without any weight are left out and fall back to a default income
+        economics = economics[totals > 0]
+        totals = totals[totals > 0]
+
+        block_ids, block_index = np.unique(economics["block_id"].to_numpy(), return_inverse=True)
+        within = economics.groupby("block_id")["pct"].cumsum() / totals
+        within = within.to_numpy(dtype=float, copy=True)
+        # Guard against floating point drift on the last bracket of each block
+        last = np.r_[block_index[1:] != block_index[:-1], True]
+        within[last] = 1.0
+
+        return cls(
+            block_ids=block_ids,
+            cumulative=block_index + within,
+            lower=economics["household_income_lower_bound"].to_numpy(dtype=float),
+            upper=economics["household_income_upper_bound"].to_numpy(dtype=float),
+        )
+
+    def draw(self, block_ids, keys, default: float) -> np.ndarray:
+        """Draw an income for each key from the bracket weights of its census block.
+
+        Args:
+            block_ids: Census block of each household.
+            keys: Household ids used to seed the draws.
+            default: Income for households in blocks without economics data.
+        """
+        block_ids = np.asarray(block_ids, dtype=object)
+        keys = np.asarray(keys)
+        income = np.full(len(keys), default, dtype=float)
+        if not len(self.block_ids) or not len(keys):
+            return income
+
+        position = np.searchsorted(self.block_ids, block_ids)
+        position = np.minimum(position, len(self.block_ids) - 1)
+        known = self.block_ids[position] == block_ids
+
+        target = position[known] + hashed_uniform(keys[known], stream=0)
+        bracket = np.searchsorted(self.cumulative, target, side="right")
+        lower, upper = self.lower[bracket], self.upper[bracket]
+        income[known] = lower + hashed_uniform(keys[known], stream=1) * (upper - lower)
+        return income
@@ -0,0 +1,144 @@
+"""
+Subsets of households to build BEAM inputs for.
+
+A household filter is any object with a ``where()`` method returning a predicate on
+``models.Household``.  Generators in `hcme.demand.reactor` apply the predicate to every
+query so that population, households, attributes and vehicles stay consistent.
+
+Filters are combined with `Intersection`, e.g. a 10% sample of a region:
+
+    .. code-block:: python
+
+        region = Region(taz_ids=(12, 13, 14), contained=True)
+        build_travel_diary(0.5, "south-county", region=region, sample_fraction=0.1)
+"""
+from dataclasses import dataclass
+from typing import Tuple
+
+import geoalchemy2 as ga
+import sqlalchemy as sa
+
+from hcme.db import models
+
+TAZ = "taz"
+CENSUS_BLOCK = "census_block"
+
+strata_columns = {
+    TAZ: models.Location.taz_id,
+    CENSUS_BLOCK: models.Location.census_block_geoid,
+}
+
+
+@dataclass(frozen=True)
+class HouseholdSample:
+    """Deterministic sample of eligible households stratified by home TAZ or census block.
+
+    Households in each stratum are ordered by a seeded hash of their id and the first
+    ``ceil(fraction * n)`` of them are selected, so that every stratum with households
+    keeps at least one and spatial demand is preserved.  The same seed and fraction always
+    select the same households, and a larger fraction selects a superset.
+    """
+
+    fraction: float
+    seed: int = 0
+    strata: str = TAZ
+
+    def __post_init__(self):
+        if not 0 < self.fraction <= 1:
+            raise ValueError(f"Sample fraction must be in (0, 1], got {self.fraction}")
+        if self.strata not in strata_columns:
+            raise ValueError(f"Strata must be one of {list(strata_columns)}, got {self.strata}")
+
+    def households(self) -> sa.sql.Select:
+        """Ids of the sampled households."""
+        stratum = strata_columns[self.strata]
+        order = sa.func.md5(sa.literal(f"{self.seed}:") + sa.cast(models.Household.id, sa.String))
+        ranked = (
+            sa.select(
+                models.Household.id,
+                sa.func.row_number().over(partition_by=stratum, order_by=order).label("rank"),
+                sa.func.count().over(partition_by=stratum).label("size"),
+            )
+            .join(models.Location, models.Location.id == models.Household.location_id)
+            .where(
+                models.Location.id.in_(
+                    sa.select(models.eligible_household_locations.c.location_id)
+                )
+            )
+            .subquery()
+        )
+        return sa.select(ranked.c.id).where(
+            ranked.c.rank <= sa.func.ceil(ranked.c.size * self.fraction)
+        )
+
+    def where(self):
+        return models.Household.id.in_(self.households())
+
+
+@dataclass(frozen=True)
+class Region:
+    """Households living within a polygon and/or a set of TAZs.
+
+    Locations are selected with ``ST_Intersects`` against ``locations.coordinates`` and
+    ``tazs.geometry``, which are both GIST indexed.
+
+    Attributes:
+        wkt: Polygon in EPSG:4326 as well known text.
+        taz_ids: Ids of TAZs making up the region.
+        contained: Only select households whose members' trips all start and end within
+            the region.  Otherwise every trip of households living in the region is kept.
+    """
+
+    wkt: str = None
+    taz_ids: Tuple[int, ...] = ()
+    contained: bool = False
+
+    def __post_init__(self):
+        if self.wkt is None and not self.taz_ids:
+            raise ValueError("A region needs a polygon or TAZ ids")
+        if self.wkt is not None and not self.wkt.strip():
+            raise ValueError("The region polygon is empty")
+        if isinstance(self.taz_ids, (str, int)):
+            raise ValueError(f"TAZ ids must be a sequence of ids, got {self.taz_ids!r}")
+        # Lists are accepted for convenience but the region must stay hashable
+        object.__setattr__(self, "taz_ids", tuple(self.taz_ids))
+
+    def locations(self) -> sa.sql.Select:
+        """Ids of the locations within the region."""
+        query = sa.select(models.Location.id)
+        if self.taz_ids:
+            query = query.join(
+                models.TAZ,
+                ga.functions.ST_Intersects(models.TAZ.geometry, models.Location.coordinates),
+            ).where(models.TAZ.id.in_(self.taz_ids))
+        if self.wkt is not None:
+            polygon = ga.functions.ST_GeomFromText(self.wkt, 4326)
+            query = query.where(ga.functions.ST_Intersects(models.Location.coordinates, polygon))
+        return query
+
+    def where(self):
+        locations = self.locations()
+        home = models.Household.location_id.in_(locations)
+        if not self.contained:
+            return home
+        leaving = (
+            sa.select(models.Person.household_id)
+            .join(models.Trip, models.Trip.person_id == models.Person.id)
+            .where(
+                sa.or_(
+                    models.Trip.origin_location_id.not_in(locations),
+                    models.Trip.destination_location_id.not_in(locations),
+                )
+            )
+        )
+        return sa.and_(home, models.Household.id.not_in(leaving))
+
+
+@dataclass(frozen=True)
+class Intersection:
+    """Households selected by every one of ``filters``."""
+
+    filters: Tuple
+
+    def where(self):
+        return sa.and_(*[household_filter.where() for household_filter in self.filters])
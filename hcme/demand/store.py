@@ -0,0 +1,145 @@
+"""
+Columnar snapshot of the data needed to render BEAM inputs.
+
+A plans store is a directory of Parquet files written once from the database with
+`build_plans_store`.  Renderers read it back through memory mapped record batches, so
+repeated scenario builds do not query Postgres at all:
+
+    .. code-block:: python
+
+        store = build_plans_store("/path/to/store")
+        build_travel_diary(0.5, "scenario", store=store)
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from hcme.db import Session
+from hcme.db.io import chunk
+from hcme.demand import reactor
+
+# Rows per record batch written to and read from the store
+BATCH_SIZE = 50000
+
+TRIPS = "trips.parquet"
+HOUSEHOLDS = "households.parquet"
+HOUSEHOLD_ATTRIBUTES = "household_attributes.parquet"
+PERSON_ATTRIBUTES = "person_attributes.parquet"
+
+schemas = {
+    TRIPS: pa.schema(
+        [
+            ("person_id", pa.int64()),
+            ("departure", pa.duration("us")),
+            ("is_origin_home", pa.bool_()),
+            ("is_destination_home", pa.bool_()),
+            ("origin_x", pa.float64()),
+            ("origin_y", pa.float64()),
+            ("destination_x", pa.float64()),
+            ("destination_y", pa.float64()),
+        ]
+    ),
+    HOUSEHOLDS: pa.schema(
+        [
+            ("id", pa.int64()),
+            ("members", pa.list_(pa.int64())),
+            ("income", pa.float64()),
+        ]
+    ),
+    HOUSEHOLD_ATTRIBUTES: pa.schema(
+        [
+            ("id", pa.int64()),
+            ("homecoordx", pa.float64()),
+            ("homecoordy", pa.float64()),
+        ]
+    ),
+    PERSON_ATTRIBUTES: pa.schema(
+        [
+            ("id", pa.int64()),
+            ("household_id", pa.int64()),
+            ("rank", pa.int64()),
+        ]
+    ),
+}
+
+
+def write_records(path: Path, records: Iterable[Dict], schema: pa.Schema) -> int:
+    """Write dict records to a Parquet file in batches and return the number of rows."""
+    n = 0
+    with pq.ParquetWriter(str(path), schema) as writer:
+        for batch in chunk(records, BATCH_SIZE):
+            batch = pa.RecordBatch.from_pylist(list(batch), schema=schema)
+            writer.write_batch(batch)
+            n += batch.num_rows
+    logger.info("Wrote {n} rows to {path}", n=n, path=path)
+    return n
+
+
+def build_plans_store(root: str, refresh: bool = True) -> "PlansStore":
+    """Snapshot persons, households, trips and projected coordinates from the database.
+
+    Args:
+        root: Directory to write the store to.
+        refresh: Recompute the eligible household locations first.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    if refresh:
+        reactor.refresh_eligible_locations()
+
+    session = Session()
+    trips = (trip._asdict() for trip in reactor.projected_trips(session))
+    write_records(root / TRIPS, trips, schemas[TRIPS])
+    session.close()
+
+    write_records(root / HOUSEHOLDS, reactor.household_records(), schemas[HOUSEHOLDS])
+    write_records(
+        root / HOUSEHOLD_ATTRIBUTES,
+        reactor.generate_household_attributes(),
+        schemas[HOUSEHOLD_ATTRIBUTES],
+    )
+    write_records(
+        root / PERSON_ATTRIBUTES,
+        reactor.generate_person_attributes(),
+        schemas[PERSON_ATTRIBUTES],
+    )
+    return PlansStore(root)
+
+
+@dataclass
+class PlansStore:
+    """Read BEAM renderer inputs from a snapshot written by `build_plans_store`."""
+
+    root: str
+
+    def __post_init__(self):
+        self.root = Path(self.root)
+        for name in schemas:
+            assert (self.root / name).exists(), f"{self.root / name} does not exist"
+
+    def read(self, name: str, columns=None) -> Iterable[Dict]:
+        """Stream the rows of a table in the store as dicts."""
+        parquet = pq.ParquetFile(str(self.root / name), memory_map=True)
+        for batch in parquet.iter_batches(batch_size=BATCH_SIZE, columns=columns):
+            yield from batch.to_pylist()
+
+    def trips(self) -> Iterable[reactor.ProjectedTrip]:
+        for row in self.read(TRIPS):
+            yield reactor.ProjectedTrip(**row)
+
+    def person_plans(self) -> Iterable[Dict]:
+        return reactor.plans_from_trips(self.trips())
+
+    def households(self) -> Iterable[Dict]:
+        return self.read(HOUSEHOLDS)
+
+    def household_attributes(self) -> Iterable[Dict]:
+        return self.read(HOUSEHOLD_ATTRIBUTES)
+
+    def person_attributes(self) -> Iterable[Dict]:
+        for row in self.read(PERSON_ATTRIBUTES):
+            yield {**row, "excluded_modes": []}
@@ -0,0 +1,20 @@
+import pytest
+
+from hcme.beam.factory import LXML
+from hcme.demand.reactor import RenderJob, id_ranges, write_sharded
+
+
+def test_id_ranges():
+    assert id_ranges(1, 10, 3) == [(1, 4), (4, 7), (7, 11)]
+    # Fewer ids than shards
+    assert id_ranges(5, 6, 4) == [(5, 6), (6, 7)]
+
+
+def test_id_ranges_without_ids():
+    assert id_ranges(None, None, 4) == []
+
+
+def test_sharded_jobs_require_jinja(tmp_path):
+    job = RenderJob("population", "population", None, str(tmp_path / "population.xml"), 2, LXML)
+    with pytest.raises(ValueError):
+        write_sharded(job)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from hcme.demand.sampling import IncomeIndex, binomial, hashed_uniform
+
+economics = pd.DataFrame(
+    {
+        "block_id": ["a", "a", "a", "b", "c"],
+        "pct": [0.5, 0.0, 0.5, 1.0, 0.0],
+        "household_income_lower_bound": [0, 10000, 20000, 100000, 5000],
+        "household_income_upper_bound": [10000, 20000, 30000, 200000, 6000],
+    }
+)
+
+
+def test_hashed_uniform_is_keyed_by_id():
+    """Draws must not depend on how households are batched."""
+    ids = np.arange(1, 1001)
+    draws = hashed_uniform(ids)
+    assert np.array_equal(draws[500:], hashed_uniform(ids[500:]))
+    assert ((draws >= 0) & (draws < 1)).all()
+    assert not np.array_equal(draws, hashed_uniform(ids, stream=1))
+
+
+def test_binomial_is_monotonic_in_p():
+    ids = np.arange(1, 1001)
+    members = ids % 5
+    low = binomial(ids, members, 0.2)
+    high = binomial(ids, members, 0.8)
+    assert (low <= high).all()
+    assert (high <= members).all()
+    assert not binomial(ids, np.zeros_like(ids), 1.0).any()
+
+
+def test_income_index_draws_from_block_brackets():
+    index = IncomeIndex.from_frame(economics)
+    ids = np.arange(1, 3001)
+    blocks = np.array(["a", "b", "c"], dtype=object)[ids % 3]
+    income = index.draw(blocks, ids, default=40000)
+
+    in_a = income[blocks == "a"]
+    # The zero-weight bracket of block "a" is never selected
+    assert ((in_a < 10000) | (in_a >= 20000)).all()
+    assert ((income[blocks == "b"] >= 100000) & (income[blocks == "b"] < 200000)).all()
+    # Blocks without weights or data fall back to the default
+    assert (income[blocks == "c"] == 40000).all()
+    assert (index.draw(["missing"], [1], default=1.0) == 1.0).all()
+    assert np.array_equal(income[:10], index.draw(blocks[:10], ids[:10], default=40000))
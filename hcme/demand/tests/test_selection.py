@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from hcme.demand import reactor
+from hcme.demand.selection import CENSUS_BLOCK, HouseholdSample, Region
+
+POLYGON = "POLYGON((-105.1 39.6, -104.9 39.6, -104.9 39.8, -105.1 39.6))"
+
+
+def compile_query(query):
+    compiled = query.compile(dialect=postgresql.dialect())
+    return str(compiled), compiled.params
+
+
+def test_household_sample_ranks_within_strata():
+    sql, params = compile_query(HouseholdSample(0.1, seed=3).households())
+    assert "PARTITION BY locations.taz_id ORDER BY md5(" in sql
+    assert "rank <= ceil(anon_1.size * %(size_1)s)" in sql
+    assert "eligible_household_locations" in sql
+    assert params["size_1"] == 0.1
+
+    sql, _ = compile_query(HouseholdSample(0.1, strata=CENSUS_BLOCK).households())
+    assert "PARTITION BY locations.census_block_geoid" in sql
+
+
+def test_household_sample_seed():
+    """The seed keys the order of households, so the same seed selects the same ones."""
+    _, params = compile_query(HouseholdSample(0.5, seed=3).households())
+    assert list(params.values()).count("3:") == 1
+    _, other = compile_query(HouseholdSample(0.5, seed=3).households())
+    assert other == params
+    _, other = compile_query(HouseholdSample(0.5, seed=4).households())
+    assert "4:" in other.values() and "3:" not in other.values()
+
+
+@pytest.mark.parametrize("fraction", [0, -0.1, 1.5])
+def test_household_sample_fraction(fraction):
+    with pytest.raises(ValueError):
+        HouseholdSample(fraction)
+
+
+def test_household_sample_strata():
+    HouseholdSample(1)
+    with pytest.raises(ValueError):
+        HouseholdSample(0.5, strata="county")
+
+
+def test_sample_from_store_writes_nothing(monkeypatch):
+    """Unsupported arguments are rejected before the scaling config is written."""
+    written = []
+    monkeypatch.setattr(reactor, "write_scaling_config", lambda *args: written.append(args))
+    with pytest.raises(ValueError):
+        reactor.build_travel_diary(0.5, "sample", store=object(), sample_fraction=0.1)
+    assert not written
+
+
+def test_region_taz_ids():
+    region = Region(taz_ids=[12, 13])
+    assert region.taz_ids == (12, 13)
+    sql, params = compile_query(region.where())
+    assert sql.startswith("households.location_id IN (SELECT locations.id")
+    assert "JOIN tazs ON ST_Intersects(tazs.geometry, locations.coordinates)" in sql
+    assert params["id_1"] == [12, 13]
+    assert "ST_GeomFromText" not in sql and "trips" not in sql
+
+
+def test_region_wkt():
+    sql, params = compile_query(Region(wkt=POLYGON).where())
+    assert "ST_Intersects(locations.coordinates, ST_GeomFromText(" in sql
+    assert list(params.values()) == [POLYGON, 4326]
+    assert "tazs" not in sql
+
+    # Both a polygon and TAZs narrow the region down to their intersection
+    sql, _ = compile_query(Region(wkt=POLYGON, taz_ids=[12]).where())
+    assert "tazs.id IN" in sql and "ST_GeomFromText" in sql
+
+
+@pytest.mark.parametrize(
+    "arguments", [{}, {"taz_ids": []}, {"wkt": " "}, {"taz_ids": 12}, {"taz_ids": "12"}]
+)
+def test_region_validation(arguments):
+    with pytest.raises(ValueError):
+        Region(**arguments)
+
+
+def test_region_contained():
+    """Households with any trip starting or ending outside the region are excluded."""
+    sql, _ = compile_query(Region(taz_ids=[12], contained=True).where())
+    home, leaving = sql.split(" AND (households.id NOT IN (")
+    assert home.startswith("households.location_id IN (SELECT locations.id")
+    assert "FROM persons JOIN trips ON trips.person_id = persons.id" in leaving
+    assert "trips.origin_location_id NOT IN (SELECT locations.id" in leaving
+    assert " OR (trips.destination_location_id NOT IN (SELECT locations.id" in leaving
@@ -0,0 +1,89 @@
+import datetime
+
+import pyarrow.parquet as pq
+import pytest
+
+from hcme.demand import store as plans_store
+from hcme.demand.reactor import ProjectedTrip
+
+
+def trip(person_id, hours, is_origin_home, is_destination_home, x, y):
+    return ProjectedTrip(
+        person_id=person_id,
+        departure=datetime.timedelta(hours=hours),
+        is_origin_home=is_origin_home,
+        is_destination_home=is_destination_home,
+        origin_x=x,
+        origin_y=y,
+        destination_x=x + 1.0,
+        destination_y=y + 1.0,
+    )
+
+
+trips = [
+    trip(2, 8, True, False, 10.0, 20.0),
+    trip(2, 17.5, False, True, 11.0, 21.0),
+    trip(1, 9, True, False, 0.0, 0.0),
+]
+
+tables = {
+    plans_store.TRIPS: [t._asdict() for t in trips],
+    plans_store.HOUSEHOLDS: [
+        {"id": 1, "members": [2], "income": 50000.0},
+        {"id": 2, "members": [1], "income": None},
+    ],
+    plans_store.HOUSEHOLD_ATTRIBUTES: [
+        {"id": 1, "homecoordx": 10.0, "homecoordy": 20.0},
+        {"id": 2, "homecoordx": 0.0, "homecoordy": 0.0},
+    ],
+    plans_store.PERSON_ATTRIBUTES: [
+        {"id": 1, "household_id": 2, "rank": 0},
+        {"id": 2, "household_id": 1, "rank": 0},
+    ],
+}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Write several batches per table
+    monkeypatch.setattr(plans_store, "BATCH_SIZE", 2)
+    for name, records in tables.items():
+        n = plans_store.write_records(tmp_path / name, records, plans_store.schemas[name])
+        assert n == len(records)
+    return plans_store.PlansStore(tmp_path)
+
+
+def test_schemas(store):
+    for name, schema in plans_store.schemas.items():
+        assert pq.read_schema(store.root / name).equals(schema)
+
+
+def test_person_plans(store):
+    assert list(store.trips()) == trips
+
+    # Plans keep the order persons were written in
+    plans = list(store.person_plans())
+    assert [plan["id"] for plan in plans] == [2, 1]
+    assert plans[0]["plan"] == [
+        {"type": "Home", "x": 10.0, "y": 20.0, "end_time": "8:00:00"},
+        {"type": "Other", "x": 11.0, "y": 21.0, "end_time": "17:30:00"},
+        {"type": "Home", "x": 12.0, "y": 22.0},
+    ]
+
+
+def test_read_table(store):
+    assert list(store.read(plans_store.HOUSEHOLDS, columns=["id", "income"])) == [
+        {"id": 1, "income": 50000.0},
+        {"id": 2, "income": None},
+    ]
+    assert list(store.person_attributes())[0] == {
+        "id": 1,
+        "household_id": 2,
+        "rank": 0,
+        "excluded_modes": [],
+    }
+
+
+def test_missing_table(tmp_path):
+    with pytest.raises(AssertionError):
+        plans_store.PlansStore(tmp_path)
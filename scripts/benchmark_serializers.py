@@ -0,0 +1,92 @@
+"""Benchmark the Jinja templates against the lxml serializers for BEAM inputs.
+
+Synthetic records shaped like the outputs of `hcme.demand.reactor` are written with both
+backends and the outputs are checked to be byte-identical, which holds because the
+synthetic values contain no quotes.
+
+Example:
+    $ python scripts/benchmark_serializers.py -n 50000
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+from tabulate import tabulate
+
+from hcme.beam.factory import JINJA, LXML, TemplateLoader
+
+
+def synthetic_data(n: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    population = []
+    households = []
+    for i in range(n):
+        legs = int(rng.integers(2, 6))
+        x = rng.uniform(380000, 440000, legs).tolist()
+        y = rng.uniform(4400000, 4560000, legs).tolist()
+        plan = [
+            {"type": "Home" if j in (0, legs - 1) else "Other", "x": x[j], "y": y[j]}
+            for j in range(legs)
+        ]
+        for j, activity in enumerate(plan[:-1]):
+            activity["end_time"] = f"{7 + j}:{int(rng.integers(0, 60)):02d}:00"
+        population.append({"id": i, "plan": plan, "rank": 0, "excluded_modes": []})
+        households.append(
+            {
+                "id": i,
+                "members": [i],
+                "vehicles": [f"{i}-0"],
+                "income": float(rng.uniform(10000, 200000)),
+                "homecoordx": x[0],
+                "homecoordy": y[0],
+            }
+        )
+    return {"population": population, "households": households}
+
+
+@click.command()
+@click.option("-n", "--records", type=click.INT, default=20000, show_default=True)
+@click.option("-r", "--repeat", type=click.INT, default=3, show_default=True)
+def main(records, repeat):
+    """Time each backend for every input type and report records per second."""
+    data = synthetic_data(records)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for template in [
+            "population",
+            "households",
+            "population_attributes",
+            "household_attributes",
+        ]:
+            timings = {}
+            outputs = {}
+            for backend in [JINJA, LXML]:
+                output = Path(tmp) / f"{template}.{backend}.xml"
+                best = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    TemplateLoader(template, data, backend=backend).write(str(output))
+                    best = min(best, time.perf_counter() - start)
+                timings[backend] = best
+                outputs[backend] = output.read_bytes()
+            rows.append(
+                [
+                    template,
+                    f"{records / timings[JINJA]:,.0f}",
+                    f"{records / timings[LXML]:,.0f}",
+                    f"{timings[JINJA] / timings[LXML]:.2f}x",
+                    outputs[JINJA] == outputs[LXML],
+                ]
+            )
+    click.echo(
+        tabulate(
+            rows,
+            headers=["input", "jinja records/s", "lxml records/s", "speedup", "identical"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,12 @@ TODO:
 - Implement tool to track individual journeys from events.
 """
 import click
-import geopandas as gpd
 import pandas as pd
 import plotly.express as px
-import sqlalchemy as sa
 
-from hcme.config import mapbox_token
-from hcme.db import engine, models
+from hcme.beam.events.index import EventIndex
+from hcme.beam.network import LinkGeometryStore
+from hcme.config import mapbox_token, output_dir
 
 px.set_mapbox_access_token(mapbox_token)
 
@@ -20,26 +19,17 @@ pd.set_option("display.max_columns", None)
 
 
 def parse_journey(agent_events_fp, person_id):
-    agent_events = pd.read_csv(agent_events_fp)
-
-    person_events = agent_events.query("person == @person_id").dropna(axis=1, how="all")
-    links = person_events["link"].dropna().tolist()
-
-    q = sa.select(
-        models.Link.id,
-        models.Link.geometry.label("geometry"),
-        models.Link.from_node_id,
-        models.Link.to_node_id,
-    ).where(models.Link.id.in_(links))
-
-    segments = gpd.read_postgis(q, con=engine, geom_col="geometry")
-
-    # Separate out latitudes and longitudes
-    coordinates = segments.geometry.apply(lambda x: x.coords.xy)
-    # Concatenate all the latitudes and longitudes into one list
-
-    longitudes = coordinates.str.get(0).sum().tolist()
-    latitudes = coordinates.str.get(1).sum().tolist()
+    # Seek to the person's rows through the sidecar index instead of reading every event
+    person_events = EventIndex(agent_events_fp).read(person=person_id)
+    person_events = person_events.dropna(axis=1, how="all")
+    links = person_events["link"].dropna().astype(int)
+    # Links appear on several events, e.g. when entering and leaving them
+    links = links[links != links.shift()].tolist()
+
+    # Coordinates of the route from the link geometry store instead of one query per link
+    store = LinkGeometryStore.load_or_build(output_dir / "beam/network-geometry")
+    (polyline,) = store.polylines([links])
+    longitudes, latitudes = polyline[:, 0].tolist(), polyline[:, 1].tolist()
 
     # Create a new linestring
     fig = px.line_mapbox(lon=longitudes, lat=latitudes)